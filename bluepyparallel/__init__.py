@@ -17,9 +17,56 @@ Provides an embarrassingly parallel tool with sql backend.
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
 import importlib.metadata
-
-from bluepyparallel.evaluator import evaluate  # noqa
-from bluepyparallel.parallel import init_parallel_factory  # noqa
+from typing import TYPE_CHECKING
 
 __version__ = importlib.metadata.version("BluePyParallel")
+
+if TYPE_CHECKING:  # pragma: no cover
+    # Let the static analysis tools resolve the attributes that are imported lazily
+    from bluepyparallel.evaluator import evaluate
+    from bluepyparallel.parallel import init_parallel_factory
+    from bluepyparallel.parameter_space import LatinHypercubeSampler
+    from bluepyparallel.parameter_space import ParameterGrid
+    from bluepyparallel.parameter_space import SobolSampler
+    from bluepyparallel.pipeline import Stage
+    from bluepyparallel.pipeline import evaluate_pipeline
+
+__all__ = [
+    "evaluate",
+    "evaluate_pipeline",
+    "init_parallel_factory",
+    "LatinHypercubeSampler",
+    "ParameterGrid",
+    "SobolSampler",
+    "Stage",
+]
+
+# The public functions are imported lazily, so the workers that only need to import some
+# functions of the package do not have to import pandas or the parallel libraries
+_LAZY_ATTRIBUTES = {
+    "evaluate": "bluepyparallel.evaluator",
+    "evaluate_pipeline": "bluepyparallel.pipeline",
+    "init_parallel_factory": "bluepyparallel.parallel",
+    "LatinHypercubeSampler": "bluepyparallel.parameter_space",
+    "ParameterGrid": "bluepyparallel.parameter_space",
+    "SobolSampler": "bluepyparallel.parameter_space",
+    "Stage": "bluepyparallel.pipeline",
+}
+
+
+def __getattr__(name):
+    """Import the public functions when they are accessed for the first time."""
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    """List the attributes of the package, including the ones that are not imported yet."""
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
@@ -0,0 +1,171 @@
+"""Module used to store NumPy arrays as compressed binary blobs."""
+
+# Copyright 2021-2024 Blue Brain Project / EPFL
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import struct
+import zlib
+
+import numpy as np
+
+try:  # pragma: no cover
+    import zstandard
+
+    zstandard_available = True
+except ImportError:
+    zstandard_available = False
+
+try:  # pragma: no cover
+    import lz4.frame
+
+    lz4_available = True
+except ImportError:
+    lz4_available = False
+
+
+_MAGIC = b"BPPA"
+_HEADER = struct.Struct("<4sBI")
+_CODECS = ["none", "zlib", "zstd", "lz4"]
+
+
+def default_codec():
+    """Get the default codec, which is ``zstd`` if :mod:`zstandard` is installed or ``zlib``."""
+    if zstandard_available:  # pragma: no cover
+        return "zstd"
+    return "zlib"
+
+
+def _compress(codec, data):
+    if codec == "none":
+        return data
+    if codec == "zlib":
+        return zlib.compress(data, 1)
+    if codec == "zstd":  # pragma: no cover
+        return zstandard.ZstdCompressor().compress(data)
+    if codec == "lz4":  # pragma: no cover
+        return lz4.frame.compress(data)
+    raise ValueError(f"The codec must be one of {_CODECS} but is '{codec}'")
+
+
+def _decompress(codec, data):
+    if codec == "none":
+        return data
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":  # pragma: no cover
+        return zstandard.ZstdDecompressor().decompress(data)
+    return lz4.frame.decompress(data)  # pragma: no cover
+
+
+def encode_array(array, codec=None):
+    """Encode an array into a binary blob.
+
+    The blob is made of a header, containing the codec and the dtype and shape of the array,
+    followed by the data of the array in C order, compressed with the given codec (``none``,
+    ``zlib``, ``zstd`` or ``lz4``).
+
+    Args:
+        array (numpy.ndarray): the array to encode.
+        codec (str): the codec used to compress the data (the default one if not given).
+
+    Return:
+        bytes: the encoded array.
+    """
+    if codec is None:
+        codec = default_codec()
+    array = np.asarray(array)
+    if array.dtype.hasobject or array.dtype.names is not None:
+        raise ValueError("Only the arrays of numbers, booleans or strings can be encoded")
+    data = _compress(codec, np.ascontiguousarray(array).tobytes())
+    metadata = json.dumps({"dtype": array.dtype.str, "shape": array.shape}).encode()
+    return _HEADER.pack(_MAGIC, _CODECS.index(codec), len(metadata)) + metadata + data
+
+
+def _decode_header(blob):
+    magic, codec, metadata_size = _HEADER.unpack_from(blob)
+    if magic != _MAGIC:
+        raise ValueError("The blob does not contain an encoded array")
+    metadata = json.loads(bytes(blob[_HEADER.size : _HEADER.size + metadata_size]))
+    offset = _HEADER.size + metadata_size
+    return _CODECS[codec], np.dtype(metadata["dtype"]), tuple(metadata["shape"]), offset
+
+
+def decode_array(blob):
+    """Decode an array from a binary blob created by :func:`encode_array`.
+
+    The returned array is a read-only view of the blob (or of the decompressed data), so the data
+    are not copied.
+    """
+    codec, dtype, shape, offset = _decode_header(blob)
+    count = int(np.prod(shape))
+    if count == 0:
+        return np.empty(shape, dtype=dtype)
+    if codec == "none":
+        data = blob
+    else:
+        data = _decompress(codec, memoryview(blob)[offset:])
+        offset = 0
+    return np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+class LazyArray:
+    """An array stored as a binary blob that is only decoded when it is used.
+
+    The dtype and the shape are read from the header of the blob without decoding the data. The
+    array is decoded by :meth:`load` or when the object is converted by :func:`numpy.asarray`,
+    and is then cached.
+    """
+
+    __slots__ = ["blob", "_array"]
+
+    def __init__(self, blob):
+        self.blob = blob
+        self._array = None
+
+    @property
+    def dtype(self):
+        """The dtype of the array."""
+        return _decode_header(self.blob)[1]
+
+    @property
+    def shape(self):
+        """The shape of the array."""
+        return _decode_header(self.blob)[2]
+
+    def load(self):
+        """Decode the array."""
+        if self._array is None:
+            self._array = decode_array(self.blob)
+        return self._array
+
+    def __array__(self, dtype=None, copy=None):
+        """Convert into a NumPy array."""
+        array = self.load()
+        if dtype is not None and np.dtype(dtype) != array.dtype:
+            return array.astype(dtype)
+        if copy:
+            return array.copy()
+        return array
+
+    def __len__(self):
+        """Get the length of the array."""
+        shape = self.shape
+        if not shape:
+            raise TypeError("len() of unsized object")
+        return shape[0]
+
+    def __repr__(self):
+        """Represent the array without decoding it."""
+        return f"LazyArray(shape={self.shape}, dtype={self.dtype})"
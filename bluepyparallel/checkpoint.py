@@ -0,0 +1,141 @@
+"""Module used to provide an append-only checkpoint log in which the results are stored."""
+
+# Copyright 2021-2024 Blue Brain Project / EPFL
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import pickle
+import struct
+import time
+import zlib
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointLog:
+    """A local append-only file in which the results are written by batches.
+
+    Each batch is stored as a frame made of a header, containing the length and the CRC32 checksum
+    of the payload, followed by the payload, which is the pickled list of the records of the batch.
+    The results are buffered in memory and a new frame is appended to the file when the buffer
+    contains ``batch_size`` records or when the last frame was written more than ``flush_interval``
+    seconds ago. The records of the buffer are thus lost if the process crashes, while a frame that
+    was only partially written is detected and ignored when the log is loaded.
+
+    Args:
+        path (str): the path to the log file.
+        batch_size (int): the maximum number of records buffered before they are written.
+        flush_interval (float): the maximum number of seconds between two writes.
+        fsync (bool): if set to True, the file is synchronized to the disk after each write, which
+            also protects the results against a crash of the node, not only of the process.
+    """
+
+    _header = struct.Struct(">II")
+
+    def __init__(self, path, batch_size=1000, flush_interval=1.0, fsync=False):
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._buffer = []
+        self._file = None
+        self._last_flush = time.monotonic()
+
+    def __del__(self):
+        """Write the buffered records and close the file."""
+        self.close()
+
+    def exists(self):
+        """Check that the log file exists."""
+        return os.path.exists(self.path)
+
+    def create(self):
+        """Create an empty log file, replacing the existing one."""
+        self.close()
+        self._file = open(self.path, "wb")  # pylint: disable=consider-using-with
+
+    def _read_frames(self):
+        """Read the valid frames of the log file and return their records and the valid size."""
+        records = []
+        valid_size = 0
+        with open(self.path, "rb") as file:
+            while True:
+                header = file.read(self._header.size)
+                if len(header) < self._header.size:
+                    break
+                length, checksum = self._header.unpack(header)
+                payload = file.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+                records.extend(pickle.loads(payload))
+                valid_size = file.tell()
+
+            if valid_size != file.tell():
+                logger.warning(
+                    "The end of the checkpoint log '%s' is truncated or corrupted and is ignored",
+                    self.path,
+                )
+        return records, valid_size
+
+    def load(self):
+        """Load the records of the log file and prepare the file to append new records.
+
+        The end of the file that can not be read (e.g. because the process crashed while a frame
+        was written) is removed.
+
+        Return:
+            pandas.DataFrame: the values of the records indexed by their IDs.
+        """
+        self.close()
+        records, valid_size = self._read_frames()
+        self._file = open(self.path, "r+b")  # pylint: disable=consider-using-with
+        self._file.truncate(valid_size)
+        self._file.seek(valid_size)
+
+        if not records:
+            return pd.DataFrame()
+        task_ids, values = zip(*records)
+        return pd.DataFrame(list(values), index=list(task_ids))
+
+    def append(self, task_id, values):
+        """Append a record to the buffer and write the buffer if required."""
+        self._buffer.append((task_id, values))
+        if (
+            len(self._buffer) >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records into a new frame."""
+        self._last_flush = time.monotonic()
+        if not self._buffer or self._file is None:
+            return
+        payload = pickle.dumps(self._buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(self._header.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._buffer = []
+
+    def close(self):
+        """Write the buffered records and close the file."""
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
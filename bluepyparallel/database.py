@@ -14,24 +14,50 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import io
+import os
 import re
+import shutil
+import threading
+import time
+from uuid import uuid4
 
+import numpy as np
 import pandas as pd
+from sqlalchemy import Boolean
+from sqlalchemy import Column
+from sqlalchemy import Float
+from sqlalchemy import Index
+from sqlalchemy import LargeBinary
 from sqlalchemy import MetaData
+from sqlalchemy import String
 from sqlalchemy import Table
-from sqlalchemy import bindparam
+from sqlalchemy import and_
 from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import func
 from sqlalchemy import insert
+from sqlalchemy import or_
 from sqlalchemy import schema
 from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy_utils import create_database
 from sqlalchemy_utils import database_exists
 
+from bluepyparallel.arrays import LazyArray
+from bluepyparallel.arrays import decode_array
+from bluepyparallel.arrays import encode_array
+
 try:  # pragma: no cover
     import psycopg2
-    import psycopg2.extras
 
     with_psycopg2 = True
 except ImportError:
@@ -46,29 +72,87 @@ class DataBase:
             https://docs.sqlalchemy.org/en/latest/core/engines.html#database-urls)
         create (bool): If set to True, the database will be automatically created by the
             constructor.
+        sqlite_profile (str): The name of the tuning profile used for SQLite databases (or the
+            value of the ``PARALLEL_SQLITE_PROFILE`` environment variable). The ``performance``
+            profile uses WAL journaling with ``synchronous=NORMAL``, a 64MB page cache, memory
+            mapped I/O and a single connection that is reused. With this profile, the database
+            can not be corrupted by a crash of the process or of the node, and the results
+            committed before a crash of the process are not lost. Nevertheless, the last
+            committed results might be lost in case of power loss or crash of the operating
+            system. Note that WAL journaling does not work on network file systems when several
+            nodes access the same database.
+        array_codec (str): The codec used to compress the arrays stored in the array columns (or
+            the value of the ``PARALLEL_ARRAY_CODEC`` environment variable). See
+            :func:`bluepyparallel.arrays.encode_array` for the available codecs.
         args and kwargs: They will be passed to the :func:`sqlalchemy.create_engine` function.
     """
 
     index_col = "df_index"
     _url_pattern = r"[a-zA-Z0-9_\-\+]+://.*"
+    _SQLITE_PROFILE = "PARALLEL_SQLITE_PROFILE"
+    _ARRAY_CODEC = "PARALLEL_ARRAY_CODEC"
+    sqlite_profiles = {
+        "performance": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -64000,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+        },
+    }
+
+    def __init__(self, url, *args, create=False, sqlite_profile=None, array_codec=None, **kwargs):
+        # These attributes are used by __del__, even if the initialization fails
+        self.engine = None
+        self._connection = None
+        self._writer = None
 
-    def __init__(self, url, *args, create=False, **kwargs):
         if not re.match(self._url_pattern, str(url)):
             url = "sqlite:///" + str(url)
 
+        sqlite_profile = sqlite_profile or os.getenv(self._SQLITE_PROFILE) or None
+        if sqlite_profile is not None and str(url).startswith("sqlite"):
+            if sqlite_profile not in self.sqlite_profiles:
+                raise ValueError(
+                    f"Unknown SQLite profile {sqlite_profile!r}; expected one of "
+                    f"{sorted(self.sqlite_profiles)}"
+                )
+            pragmas = self.sqlite_profiles[sqlite_profile]
+            kwargs.setdefault("poolclass", QueuePool)
+            kwargs.setdefault("pool_size", 1)
+        else:
+            pragmas = None
+
         self.engine = create_engine(url, *args, **kwargs)
 
+        if pragmas is not None:
+
+            @event.listens_for(self.engine, "connect")
+            def _set_sqlite_pragmas(dbapi_connection, _connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {pragma}={value}")
+                cursor.close()
+
         if create and not self.db_exists():
             create_database(self.engine.url)
 
-        self._connection = None
+        self.array_codec = array_codec or os.getenv(self._ARRAY_CODEC) or None
+        self.array_columns = []
         self.metadata = None
         self.table = None
+        self._insert = None
+        self.queue = None
 
     def __del__(self):
         """Close the connection and the engine to the database."""
-        self.connection.close()
-        self.engine.dispose()
+        if self._writer is not None:
+            self._writer.close()
+        # Do not use the connection property, which would open a new connection
+        if self._connection is not None:
+            self._connection.close()
+        if self.engine is not None:
+            self.engine.dispose()
 
     @property
     def connection(self):
@@ -89,8 +173,21 @@ class DataBase:
         """Get the URL of the database."""
         return self.engine.url
 
-    def create(self, df, table_name=None, schema_name=None):
-        """Create a table in the database in which the results will be written."""
+    def create(
+        self, df, table_name=None, schema_name=None, if_exists="replace", array_columns=None
+    ):
+        """Create a table in the database in which the results will be written.
+
+        The ``if_exists`` argument is passed to :meth:`pandas.DataFrame.to_sql`.
+
+        The columns given in ``array_columns`` and the columns whose first value is a
+        :class:`numpy.ndarray` are array columns: they are stored as binary columns in which the
+        arrays are written as compressed blobs (see :func:`bluepyparallel.arrays.encode_array`).
+        """
+        if array_columns is None:
+            array_columns = [
+                col for col in df.columns if len(df) > 0 and isinstance(df[col].iat[0], np.ndarray)
+            ]
         if table_name is None:
             table_name = "df"
         if schema_name is not None and schema_name not in self.connection.dialect.get_schema_names(
@@ -102,10 +199,12 @@ class DataBase:
             name=table_name,
             con=self.connection,
             schema=schema_name,
-            if_exists="replace",
+            if_exists=if_exists,
             index_label=self.index_col,
+            dtype={col: LargeBinary for col in array_columns},
         )
         self.reflect(table_name, schema_name)
+        self.create_indexes()
 
     def db_exists(self):
         """Check that the server and the database exist."""
@@ -133,25 +232,347 @@ class DataBase:
             schema=schema_name,
             autoload_with=self.engine,
         )
-
-    def load(self):
-        """Load the table data from the database."""
-        query = select(self.table)
-        return pd.read_sql(query, self.connection, index_col=self.index_col)
+        self._insert = insert(self.table)
+        self.array_columns = [
+            col.name for col in self.table.columns if isinstance(col.type, LargeBinary)
+        ]
+
+    def encode_arrays(self, keys, data):
+        """Encode the values of the array columns in rows whose columns are given by keys."""
+        positions = [i for i, key in enumerate(keys) if key in self.array_columns]
+        if not positions:
+            return data
+
+        data = [list(row) for row in data]
+        for row in data:
+            for i in positions:
+                value = row[i]
+                if isinstance(value, LazyArray):
+                    row[i] = value.blob
+                elif value is None or isinstance(value, bytes):
+                    pass
+                elif np.isscalar(value) and pd.isna(value):
+                    row[i] = None
+                else:
+                    row[i] = encode_array(value, self.array_codec)
+        return data
+
+    def _decode_arrays(self, df, lazy):
+        """Decode the blobs of the array columns of a DataFrame loaded from the table."""
+        for col in self.array_columns:
+            if col not in df.columns:
+                continue
+            # The values are assigned one by one so the arrays are not merged in a 2D array
+            values = np.empty(len(df), dtype=object)
+            for num, blob in enumerate(df[col]):
+                if blob is not None:
+                    values[num] = LazyArray(blob) if lazy else decode_array(blob)
+            df[col] = values
+        return df
+
+    def load(
+        self,
+        columns=None,
+        condition=None,
+        index_range=None,
+        valid_only=False,
+        chunksize=None,
+        lazy_arrays=True,
+    ):
+        """Load the table data from the database.
+
+        Args:
+            columns (list): the names of the columns to load (the index is always loaded). All the
+                columns are loaded by default.
+            condition (sqlalchemy.sql.expression.ColumnElement): a condition used to filter the
+                rows, e.g. :code:`db.table.c.a > 0`.
+            index_range (tuple): only load the rows whose index is in this range (bounds
+                included).
+            valid_only (bool): if set to True, only load the rows without exception.
+            chunksize (int): if given, an iterator over DataFrames of ``chunksize`` rows is
+                returned and the rows are streamed from the database when possible.
+            lazy_arrays (bool): if set to True, the values of the array columns are
+                :class:`bluepyparallel.arrays.LazyArray` objects that are only decoded when they
+                are used, otherwise they are decoded into :class:`numpy.ndarray` objects.
+
+        Return:
+            pandas.DataFrame or Iterator[pandas.DataFrame]: the loaded data.
+        """
+        if columns is None:
+            query = select(self.table)
+        else:
+            query = select(self.table.c[self.index_col], *[self.table.c[col] for col in columns])
+
+        if condition is not None:
+            query = query.where(condition)
+        if index_range is not None:
+            query = query.where(self.table.c[self.index_col].between(*index_range))
+        if valid_only:
+            query = query.where(self.table.c.exception.is_(None))
+
+        connection = self.connection
+        if chunksize is not None:
+            connection = connection.execution_options(stream_results=True)
+        res = pd.read_sql(query, connection, index_col=self.index_col, chunksize=chunksize)
+
+        if not self.array_columns:
+            return res
+        if chunksize is None:
+            return self._decode_arrays(res, lazy_arrays)
+        return (self._decode_arrays(chunk, lazy_arrays) for chunk in res)
+
+    def create_indexes(self):
+        """Create the indexes on the ``df_index`` column and on the valid rows if they are missing.
+
+        These indexes are used to filter the rows efficiently when the data are loaded. The
+        ``exception`` column contains long tracebacks that can not be stored in an index, so the
+        valid rows are indexed with a partial index on the ``df_index`` column instead.
+        """
+        index_col = self.table.c[self.index_col]
+        Index(f"ix_{self.table.name}_{self.index_col}", index_col).create(
+            self.engine, checkfirst=True
+        )
+        if "exception" in self.table.c:
+            valid = self.table.c.exception.is_(None)
+            Index(
+                f"ix_{self.table.name}_valid",
+                index_col,
+                sqlite_where=valid,
+                postgresql_where=valid,
+            ).create(self.engine, checkfirst=True)
 
     def write(self, row_id, result=None, exception=None, **input_values):
         """Write a result entry or an exception into the table."""
-        if result is not None:
-            vals = result
-        elif exception is not None:
-            vals = {"exception": exception}
-        else:
+        if result is None and exception is None:
             return
+        vals = dict(result or {})
+        if exception is not None:
+            vals["exception"] = exception
 
-        query = insert(self.table).values({**{self.index_col: row_id}, **vals, **input_values})
-        self.connection.execute(query)
+        values = {**{self.index_col: row_id}, **vals, **input_values}
+        keys = list(values.keys())
+        [row] = self.encode_arrays(keys, [list(values.values())])
+
+        # The same statement is reused so its compiled form is cached by SQLAlchemy
+        self.connection.execute(self._insert, [dict(zip(keys, row))])
         self.connection.connection.commit()
 
+    def write_batch(self, columns, data):
+        """Write entries from a list of lists into the table.
+
+        The entries are written with a :class:`BatchWriter` that is kept open, so the
+        connection and the statement are reused by the next calls.
+        """
+        if self._writer is None:
+            self._writer = self.batch_writer()
+        self._writer.write_batch(columns, data)
+
+    def batch_writer(self, commit_interval=1, upsert=False, copy=None):
+        """Create a :class:`BatchWriter` for the table."""
+        return BatchWriter(self, commit_interval=commit_interval, upsert=upsert, copy=copy)
+
+    def create_task_queue(self, task_ids, done_ids=None, table_name="task_queue"):
+        """Create a table used as a task queue shared by several processes.
+
+        Each row of the queue contains a task ID, the token of the claim that owns it, the date
+        at which this claim expires and whether the task is done. If the queue already exists
+        (e.g. because it was created by another process), it is used as is.
+
+        Args:
+            task_ids (list): the IDs of all the tasks.
+            done_ids (list): the IDs of the tasks that are already done.
+            table_name (str): the name of the table.
+        """
+        if self.engine.dialect.name == "sqlite":
+            # Allow the processes to read the DB while another one is writing into it
+            with self.engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+        self.queue = Table(
+            table_name,
+            MetaData(),
+            Column(self.index_col, self.table.c[self.index_col].type, primary_key=True),
+            Column("claimed_by", String(32)),
+            Column("lease_expires", Float),
+            Column("done", Boolean, nullable=False),
+            schema=self.table.schema,
+        )
+        try:
+            self.queue.create(self.engine, checkfirst=True)
+        except (OperationalError, ProgrammingError):  # pragma: no cover
+            # The queue was created by another process in the meantime
+            pass
+
+        done_ids = set() if done_ids is None else set(done_ids)
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    insert(self.queue),
+                    [
+                        {self.index_col: task_id, "done": task_id in done_ids}
+                        for task_id in task_ids
+                    ],
+                )
+        except IntegrityError:
+            # The queue was already filled by another process
+            pass
+
+    def _pending_tasks(self, now):
+        """Return the condition of the pending tasks of the task queue."""
+        return and_(
+            self.queue.c.done.is_(False),
+            or_(self.queue.c.lease_expires.is_(None), self.queue.c.lease_expires < now),
+        )
+
+    def claim_tasks(self, nb_tasks, lease_duration):
+        """Atomically claim at most nb_tasks pending tasks from the task queue.
+
+        A task is pending if it is not done and if it was never claimed or if its lease expired.
+        The claimed tasks can not be claimed by another process during ``lease_duration`` seconds.
+        Note that the clocks of the nodes running the processes should be synchronized.
+
+        Return:
+            list: the IDs of the claimed tasks.
+        """
+        index_col = self.queue.c[self.index_col]
+        now = time.time()
+        token = uuid4().hex
+        pending = self._pending_tasks(now)
+
+        # The pending condition is checked again in the UPDATE statement, so a task can not be
+        # claimed by two processes at the same time
+        candidates = select(index_col).where(pending).limit(nb_tasks)
+        if self.engine.dialect.name == "postgresql":  # pragma: no cover
+            # The rows selected by another process are skipped instead of being selected again
+            candidates = candidates.with_for_update(skip_locked=True)
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(self.queue)
+                .where(index_col.in_(candidates))
+                .where(pending)
+                .values(claimed_by=token, lease_expires=now + lease_duration)
+            )
+            claimed = conn.execute(select(index_col).where(self.queue.c.claimed_by == token))
+            return claimed.scalars().all()
+
+    def count_pending_tasks(self):
+        """Count the tasks of the task queue that can be claimed."""
+        statement = (
+            select(func.count()).select_from(self.queue).where(self._pending_tasks(time.time()))
+        )
+        with self.engine.connect() as conn:
+            return conn.execute(statement).scalar()
+
+    def complete_tasks(self, task_ids, connection=None):
+        """Mark the given tasks as done in the task queue.
+
+        If a connection is given, the tasks are marked in its current transaction, which is not
+        committed.
+        """
+        statement = (
+            update(self.queue)
+            .where(self.queue.c[self.index_col].in_(list(task_ids)))
+            .values(done=True)
+        )
+        if connection is not None:
+            connection.execute(statement)
+            return
+        with self.engine.begin() as conn:
+            conn.execute(statement)
+
+
+def _format_csv_value(value):
+    """Format a value for the CSV format of the PostgreSQL COPY command."""
+    if value is None:
+        # An unquoted empty value is NULL while a quoted one is an empty string
+        return ""
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    if isinstance(value, bytes):
+        # The binary values use the hex format of the bytea type
+        return '"\\x' + value.hex() + '"'
+    return str(value)
+
+
+def _rows_to_csv(rows):
+    """Serialize rows into the CSV format of the PostgreSQL COPY command."""
+    return "".join(",".join(_format_csv_value(value) for value in row) + "\n" for row in rows)
+
+
+def _supports_copy(engine):
+    """Check that the engine uses PostgreSQL with the psycopg2 driver, which provides COPY."""
+    return engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+
+
+class BatchWriter:
+    """Write entries into the table of a :class:`DataBase` using a single connection.
+
+    The connection and the insert statement are created once and reused for all the batches, and
+    a transaction is committed every ``commit_interval`` batches (the last batches are committed
+    when the writer is closed). If ``upsert`` is set to True, the entries whose index already
+    exists in the table replace the existing ones instead of being inserted again, which is only
+    supported with SQLite and PostgreSQL.
+
+    With PostgreSQL and the :mod:`psycopg2` driver, the batches are streamed to the database with
+    the ``COPY FROM STDIN`` command in CSV format, which is much faster than the ``INSERT``
+    statements used for the other drivers. This can be disabled with ``copy=False`` and is not used
+    in upsert mode.
+
+    The writer can be used as a context manager that closes it on exit.
+
+    Args:
+        db (DataBase): the database in which the entries are written.
+        commit_interval (int): the number of batches written in each transaction.
+        upsert (bool): if set to True, the existing entries are replaced.
+        copy (bool): if set to False, the ``COPY`` command is never used.
+    """
+
+    def __init__(self, db, commit_interval=1, upsert=False, copy=None):
+        self.db = db
+        self.commit_interval = commit_interval
+        self.upsert = upsert
+        self.copy = copy is not False and not upsert and _supports_copy(db.engine)
+        self._connection = db.engine.connect()
+        self._transaction = None
+        self._nb_uncommitted = 0
+
+        table = db.table
+        if upsert:
+            dialect_name = db.engine.dialect.name
+            if dialect_name == "sqlite":
+                dialect_insert = sqlite.insert
+            elif dialect_name == "postgresql":  # pragma: no cover
+                dialect_insert = postgresql.insert
+            else:  # pragma: no cover
+                raise ValueError(f"The upsert mode is not supported with {dialect_name}")
+
+            # The conflicts can only be detected with a unique index
+            unique_index = Index(
+                f"ix_unique_{table.name}_{db.index_col}", table.c[db.index_col], unique=True
+            )
+            with self._connection.begin():
+                unique_index.create(self._connection, checkfirst=True)
+
+            statement = dialect_insert(table)
+            self._statement = statement.on_conflict_do_update(
+                index_elements=[db.index_col],
+                set_={
+                    col.name: statement.excluded[col.name]
+                    for col in table.columns
+                    if col.name != db.index_col
+                },
+            )
+        else:
+            self._statement = insert(table)
+
+    def __enter__(self):
+        """Enter the context."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the writer."""
+        self.close()
+
     def write_batch(self, columns, data):
         """Write entries from a list of lists into the table."""
         if not data:  # pragma: no cover
@@ -159,15 +580,276 @@ class DataBase:
         assert len(columns) + 1 == len(
             data[0]
         ), "The columns list must have one less entry than each data element"
-        cursor = self.connection.connection.cursor()
-        cols = {col: bindparam(col) for col in [self.index_col] + columns}
-        # pylint: disable=no-value-for-parameter
-        compiled = self.table.insert().values(**cols).compile(dialect=self.engine.dialect)
 
-        if hasattr(cursor, "mogrify") and with_psycopg2:  # pragma: no cover
-            psycopg2.extras.execute_values(cursor, str(compiled), data)
+        keys = [self.db.index_col] + list(columns)
+        data = self.db.encode_arrays(keys, data)
+        if self._transaction is None:
+            self._transaction = self._connection.begin()
+        if self.copy:
+            self._copy_rows(keys, data)
         else:
-            cursor.executemany(str(compiled), data)
+            self._connection.execute(self._statement, [dict(zip(keys, row)) for row in data])
+
+        self._nb_uncommitted += 1
+        if self._nb_uncommitted >= self.commit_interval:
+            self.commit()
+
+    def _copy_rows(self, keys, data):
+        """Stream the rows to the database using the COPY command."""
+        preparer = self.db.engine.dialect.identifier_preparer
+        query = (
+            f"COPY {preparer.format_table(self.db.table)} "
+            f"({', '.join(preparer.quote(key) for key in keys)}) FROM STDIN WITH (FORMAT csv)"
+        )
+        cursor = self._connection.connection.cursor()
+        cursor.copy_expert(query, io.StringIO(_rows_to_csv(data)))
+        cursor.close()
 
-        self.connection.connection.commit()
-        self.connection.connection.close()
+    def write(self, row_id, result=None, exception=None, **input_values):
+        """Write a result entry or an exception into the table."""
+        if result is None and exception is None:
+            return
+        vals = dict(result or {})
+        if exception is not None:
+            vals["exception"] = exception
+
+        values = {**vals, **input_values}
+        self.write_batch(list(values.keys()), [[row_id] + list(values.values())])
+
+    def complete_tasks(self, task_ids):
+        """Mark the given tasks as done and commit them with the entries written before.
+
+        The results and the state of the tasks are committed in the same transaction, so the
+        tasks can not be reclaimed and written again if the process crashes in between.
+        """
+        if self._transaction is None:
+            self._transaction = self._connection.begin()
+        self.db.complete_tasks(task_ids, connection=self._connection)
+        self.commit()
+
+    def commit(self):
+        """Commit the entries written since the last commit."""
+        if self._transaction is not None:
+            self._transaction.commit()
+            self._transaction = None
+        self._nb_uncommitted = 0
+
+    def close(self):
+        """Commit the remaining entries and close the connection."""
+        if self._connection is None:
+            return
+        self.commit()
+        self._connection.close()
+        self._connection = None
+
+
+_SHARD_WRITERS = {}
+_SHARD_WRITERS_LOCK = threading.Lock()
+
+
+def _close_shard_writer(key, writer):
+    """Commit the remaining entries of a shard writer and close its database.
+
+    The writers inherited from a parent process are only forgotten because their connections
+    belong to the parent.
+    """
+    if key[2] == os.getpid():
+        try:
+            writer.close()
+        except OperationalError:  # pragma: no cover
+            # The shard was already merged and removed by another process
+            pass
+        writer.db.engine.dispose()
+
+
+class ShardWriter:
+    """Write entries into the SQLite shard of the current thread.
+
+    Only the directory of the shards, the token of the run and the template of the table are
+    pickled, so the writer can be sent to the workers of a parallel factory. Each thread of each
+    process then lazily creates its own shard the first time it writes into it, with a
+    :class:`BatchWriter` that is kept open and reused for the next entries of the same run, so
+    the threads of a dask worker never share a shard.
+
+    The shards use the ``performance`` SQLite profile, so the entries are committed every
+    ``commit_interval`` writes without synchronizing the file to the disk. The writers are closed
+    when the shards are merged, when a new run starts in the same process or when the process
+    exits. Note that the entries that are not committed yet are not visible to the other
+    processes, so the interval should be 1 if the shards are merged before the workers exit.
+
+    Args:
+        shard_dir (str): the directory in which the shards are created.
+        token (str): the token of the run, used to create new shards for each run.
+        template (pandas.DataFrame): an empty DataFrame used to create the table of the shards.
+        array_columns (list): the array columns of the table.
+        commit_interval (int): the number of writes committed in each transaction.
+    """
+
+    def __init__(self, shard_dir, token, template, array_columns=None, commit_interval=1):
+        self.shard_dir = shard_dir
+        self.token = token
+        self.template = template
+        self.array_columns = array_columns or []
+        self.commit_interval = commit_interval
+
+    def _get_writer(self):
+        key = (self.shard_dir, self.token, os.getpid(), threading.get_ident())
+        with _SHARD_WRITERS_LOCK:
+            if key not in _SHARD_WRITERS:
+                # Close the shards of the previous runs
+                for previous_key in list(_SHARD_WRITERS):
+                    if previous_key[0] == self.shard_dir and previous_key[1] != self.token:
+                        _close_shard_writer(previous_key, _SHARD_WRITERS.pop(previous_key))
+
+                os.makedirs(self.shard_dir, exist_ok=True)
+                db = DataBase(
+                    os.path.join(self.shard_dir, f"shard_{uuid4().hex}.db"),
+                    sqlite_profile="performance",
+                    # The writers of the threads can be closed by another thread
+                    connect_args={"check_same_thread": False},
+                )
+                db.create(self.template, array_columns=self.array_columns)
+                db.connection.close()
+                _SHARD_WRITERS[key] = db.batch_writer(commit_interval=self.commit_interval)
+            return _SHARD_WRITERS[key]
+
+    def write(self, row_id, result=None, exception=None, **input_values):
+        """Write a result entry or an exception into the shard."""
+        self._get_writer().write(row_id, result, exception, **input_values)
+
+    def write_batch(self, columns, data):
+        """Write entries from a list of lists into the shard."""
+        self._get_writer().write_batch(columns, data)
+
+
+def close_shard_writers(shard_dir=None):
+    """Close the writers of the shards stored in the given directory (or of all the shards)."""
+    with _SHARD_WRITERS_LOCK:
+        for key in list(_SHARD_WRITERS):
+            if shard_dir is None or key[0] == shard_dir:
+                _close_shard_writer(key, _SHARD_WRITERS.pop(key))
+
+
+atexit.register(close_shard_writers)
+
+
+class ShardedDataBase:
+    """A SQLite database whose results are written into one shard per process.
+
+    SQLite only allows one writer at a time, so the results are written by the workers into
+    their own SQLite files, stored in the ``<path>.shards`` directory next to the main database.
+    The data of the main database and of all the shards can be loaded together with
+    :meth:`load`, and the shards can be merged into the main database with :meth:`merge`.
+
+    Args:
+        url (str): The URL or the path of the main SQLite database.
+        kwargs: They will be passed to the :class:`DataBase` constructor of the main database.
+    """
+
+    table_name = "df"
+
+    def __init__(self, url, **kwargs):
+        self.main = DataBase(url, **kwargs)
+        if self.main.engine.dialect.name != "sqlite":
+            raise ValueError("The sharded databases can only be used with SQLite")
+        self.path = self.main.engine.url.database
+        self.shard_dir = self.path + ".shards"
+        self.template = None
+
+    def get_url(self):
+        """Get the URL of the main database."""
+        return self.main.get_url()
+
+    def exists(self):
+        """Check that the table exists in the main database."""
+        return self.main.exists(self.table_name)
+
+    def create(self, df):
+        """Create the table of the main database and remove the existing shards."""
+        self.remove_shards()
+        self.main.create(df, self.table_name)
+        self.template = df.loc[[]]
+
+    def reflect(self, df):
+        """Reflect the table of the main database, using ``df`` as template for the shards."""
+        self.main.reflect(self.table_name)
+        self.template = df.loc[[]]
+
+    def shard_paths(self):
+        """Get the paths of the existing shards."""
+        if not os.path.isdir(self.shard_dir):
+            return []
+        return sorted(
+            os.path.join(self.shard_dir, filename)
+            for filename in os.listdir(self.shard_dir)
+            if filename.endswith(".db")
+        )
+
+    def shard_writer(self, commit_interval=1):
+        """Create a :class:`ShardWriter` for a new run."""
+        return ShardWriter(
+            self.shard_dir,
+            uuid4().hex,
+            self.template,
+            self.main.array_columns,
+            commit_interval=commit_interval,
+        )
+
+    def load(self, columns=None, index_range=None, valid_only=False, lazy_arrays=True):
+        """Load the data from the main database and from all the shards.
+
+        The arguments are passed to :meth:`DataBase.load`.
+        """
+        load_kwargs = {
+            "columns": columns,
+            "index_range": index_range,
+            "valid_only": valid_only,
+            "lazy_arrays": lazy_arrays,
+        }
+        res = [self.main.load(**load_kwargs)]
+        for path in self.shard_paths():
+            shard = DataBase(path)
+            if not shard.exists(self.table_name):  # pragma: no cover
+                # The shard was just created by a worker
+                continue
+            shard.reflect(self.table_name)
+            res.append(shard.load(**load_kwargs))
+
+        # The empty DataFrames are discarded because their columns are not typed
+        return pd.concat([df for df in res if len(df) > 0] or res[:1])
+
+    def merge(self):
+        """Merge the shards into the main database and remove them.
+
+        The rows of each shard are copied by SQLite into the main database with a single
+        ``INSERT INTO ... SELECT`` statement.
+        """
+        close_shard_writers(self.shard_dir)
+        columns = ", ".join(f'"{col.name}"' for col in self.main.table.columns)
+        connection = self.main.engine.raw_connection()
+        try:
+            for path in self.shard_paths():
+                cursor = connection.cursor()
+                cursor.execute("ATTACH DATABASE ? AS shard", (path,))
+                try:
+                    cursor.execute(
+                        f'INSERT INTO main."{self.table_name}" ({columns}) '
+                        f'SELECT {columns} FROM shard."{self.table_name}"'
+                    )
+                    connection.commit()
+                except Exception:  # pragma: no cover
+                    connection.rollback()
+                    raise
+                finally:
+                    cursor.execute("DETACH DATABASE shard")
+                    cursor.close()
+                os.remove(path)
+        finally:
+            connection.close()
+        self.remove_shards()
+
+    def remove_shards(self):
+        """Remove all the shards."""
+        close_shard_writers(self.shard_dir)
+        if os.path.isdir(self.shard_dir):
+            shutil.rmtree(self.shard_dir)
@@ -14,22 +14,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
 import logging
 import sys
 import traceback
+from collections.abc import Mapping
 from functools import partial
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from bluepyparallel.database import DataBase
+from bluepyparallel.checkpoint import CheckpointLog
 from bluepyparallel.parallel import DaskDataFrameFactory
+from bluepyparallel.parallel import DaskFactory
+from bluepyparallel.parallel import MultiprocessingFactory
 from bluepyparallel.parallel import init_parallel_factory
+from bluepyparallel.parameter_space import ParameterSpace
 
 logger = logging.getLogger(__name__)
 
+_SPACE_CHUNK_SIZE = 10000
 
-def _try_evaluation(task, evaluation_function, func_args, func_kwargs):
+
+def _try_evaluation(task, evaluation_function, func_args, func_kwargs, shard_writer=None):
     """Encapsulate the evaluation function into a try/except and isolate to record exceptions."""
     task_id, task_args = task
 
@@ -41,19 +49,89 @@ def _try_evaluation(task, evaluation_function, func_args, func_kwargs):
         exception = "".join(traceback.format_exception(*sys.exc_info()))
         logger.exception("Exception for ID=%s: %s", task_id, exception)
 
+    # Save the result into the shard of the current process
+    if shard_writer is not None:
+        shard_writer.write(task_id, result, exception, **task_args)
+
     return task_id, result, exception
 
 
-def _try_evaluation_df(task, evaluation_function, func_args, func_kwargs):
-    task_id, result, exception = _try_evaluation(
-        (task.name, task.to_dict()),
-        evaluation_function,
-        func_args,
-        func_kwargs,
+def _evaluate_functions(row, *args, functions, context_function=None, **kwargs):
+    """Evaluate one or several named functions on the same row and gather their results.
+
+    The context computed by ``context_function`` is given to each function after the row. The
+    exception raised by a function is recorded in its own exception column, while the exception
+    raised by the context function is raised.
+    """
+    if context_function is not None:
+        args = (context_function(row), *args)
+    if not isinstance(functions, Mapping):
+        return functions(row, *args, **kwargs)
+
+    results = {}
+    for name, func in functions.items():
+        try:
+            results.update(func(row, *args, **kwargs))
+            exception = None
+        except Exception:  # pylint: disable=broad-except
+            exception = "".join(traceback.format_exception(*sys.exc_info()))
+            logger.exception("Exception in the function '%s': %s", name, exception)
+        results[f"{name}_exception"] = exception
+    return results
+
+
+def _lossless_cast(values, dtype):
+    """Cast the values to the given type only if they are not changed by the cast."""
+    if dtype == object or values.dtype == dtype:
+        return values
+    try:
+        casted = values.astype(dtype)
+    except (TypeError, ValueError):
+        return values
+    orig = values.to_numpy(dtype=object)
+    new = casted.to_numpy(dtype=object)
+    missing = pd.isnull(orig)
+    if not (missing == pd.isnull(new)).all():
+        return values
+    try:
+        if not (orig[~missing] == new[~missing]).all():
+            return values
+    except (TypeError, ValueError):  # pragma: no cover
+        return values
+    return casted
+
+
+def _try_evaluation_partition(
+    partition, evaluation_function, func_args, func_kwargs, meta, shard_writer=None
+):
+    """Evaluate each row of a partition and gather the results into the columns of meta."""
+    results = {col: [] for col in meta.columns}
+    for task in zip(partition.index, partition.to_dict("records")):
+        _, result, exception = _try_evaluation(task, evaluation_function, func_args, func_kwargs)
+        result["exception"] = exception
+        for col, values in results.items():
+            values.append(result.get(col))
+
+    res_df = pd.DataFrame(results, index=partition.index, columns=meta.columns)
+
+    # Use the types of the new columns when the results are consistent with them
+    for col, dtype in meta.dtypes.items():
+        res_df[col] = _lossless_cast(res_df[col], dtype)
+
+    # Save the results into the shard of the current process
+    if shard_writer is not None:
+        batch_complete = partition.join(res_df)
+        shard_writer.write_batch(
+            batch_complete.columns.tolist(), batch_complete.to_records().tolist()
+        )
+    return res_df
+
+
+def _new_columns_meta(new_columns):
+    """Build an empty DataFrame whose columns are typed according to the default values."""
+    return pd.DataFrame(
+        {col: pd.Series(dtype=pd.Series([value]).dtype) for col, value in new_columns}
     )
-    res_cols = list(result.keys())
-    result["exception"] = exception
-    return pd.Series(result, name=task_id, dtype="object", index=["exception"] + res_cols)
 
 
 def _evaluate_dataframe(
@@ -66,30 +144,43 @@ def _evaluate_dataframe(
     mapper,
     task_ids,
     db,
+    checkpoint=None,
+    shard_writer=None,
 ):
     """Internal evaluation function for dask.dataframe."""
-    # Setup the function to apply to the data
+    meta = _new_columns_meta(new_columns)
+
+    # Setup the function to apply to the partitions of the data
     eval_func = partial(
-        _try_evaluation_df,
+        _try_evaluation_partition,
         evaluation_function=evaluation_function,
         func_args=func_args,
         func_kwargs=func_kwargs,
+        meta=meta,
+        shard_writer=shard_writer,
     )
-    meta = pd.DataFrame({col[0]: pd.Series(dtype="object") for col in new_columns})
 
     res = []
     try:
         # Compute and collect the results
-        for batch in mapper(eval_func, to_evaluate.loc[task_ids, input_cols], meta=meta):
+        for batch in mapper(
+            eval_func, to_evaluate.loc[task_ids, input_cols], meta=meta, by_partition=True
+        ):
             res.append(batch)
 
             if db is not None:
                 batch_complete = to_evaluate[input_cols].join(batch, how="right")
                 data = batch_complete.to_records().tolist()
                 db.write_batch(batch_complete.columns.tolist(), data)
+
+            if checkpoint is not None:
+                for task_id, values in batch.to_dict("index").items():
+                    checkpoint.append(task_id, values)
     except (KeyboardInterrupt, SystemExit) as ex:  # pragma: no cover
         # To save dataframe even if program is killed
         logger.warning("Stopping mapper loop. Reason: %r", ex)
+    if not res:  # pragma: no cover
+        return meta
     return pd.concat(res)
 
 
@@ -103,6 +194,9 @@ def _evaluate_basic(
     task_ids,
     db,
     progress_bar=True,
+    memory_estimate=None,
+    checkpoint=None,
+    shard_writer=None,
 ):
     res = []
     # Setup the function to apply to the data
@@ -111,13 +205,21 @@ def _evaluate_basic(
         evaluation_function=evaluation_function,
         func_args=func_args,
         func_kwargs=func_kwargs,
+        shard_writer=shard_writer,
     )
 
     # Split the data into rows
     arg_list = list(to_evaluate.loc[task_ids, input_cols].to_dict("index").items())
 
+    # Compute the memory estimates of the rows
+    mapper_kwargs = {}
+    if callable(memory_estimate):
+        mapper_kwargs["memory_estimates"] = [memory_estimate(row) for _, row in arg_list]
+    elif memory_estimate is not None:
+        mapper_kwargs["memory_estimates"] = to_evaluate.loc[task_ids, memory_estimate].tolist()
+
     try:
-        tasks = mapper(eval_func, arg_list)
+        tasks = mapper(eval_func, arg_list, **mapper_kwargs)
         if progress_bar:
             tasks = tqdm(tasks, total=len(task_ids))
         # Compute and collect the results
@@ -129,6 +231,10 @@ def _evaluate_basic(
                 db.write(
                     task_id, result, exception, **to_evaluate.loc[task_id, input_cols].to_dict()
                 )
+
+            # Save the results into the checkpoint log
+            if checkpoint is not None:
+                checkpoint.append(task_id, dict(result, exception=exception))
     except (KeyboardInterrupt, SystemExit) as ex:
         # To save dataframe even if program is killed
         logger.warning("Stopping mapper loop. Reason: %r", ex)
@@ -137,33 +243,419 @@ def _evaluate_basic(
     return pd.DataFrame(res).set_index("df_index")
 
 
-def _prepare_db(db_url, to_evaluate, df, resume, task_ids):
+def _load_previous_results(previous_results, to_evaluate, df, task_ids):
+    """Check the previous results, insert them into to_evaluate and remove them from task_ids."""
+    previous_idx = previous_results.index
+    bad_cols = [
+        col
+        for col in df.columns
+        if not to_evaluate.loc[previous_idx, col].equals(previous_results[col])
+    ]
+    if bad_cols:
+        raise ValueError(
+            f"The following columns have different values from the DataBase: {bad_cols}"
+        )
+    to_evaluate.loc[previous_results.index] = previous_results.loc[previous_results.index]
+    return task_ids.difference(previous_results.index)
+
+
+def _prepare_db(db_url, to_evaluate, df, resume, task_ids, cooperative=False):
     """Prepare db."""
+    # The database module is only imported when it is used because SQLAlchemy is slow to import
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy.exc import OperationalError
+
+    from bluepyparallel.database import DataBase
+
     db = DataBase(db_url)
 
-    if resume and db.exists("df"):
+    if (resume or cooperative) and db.exists("df"):
         logger.info("Load data from SQL database")
         db.reflect("df")
-        previous_results = db.load()
-        previous_idx = previous_results.index
-        bad_cols = [
-            col
-            for col in df.columns
-            if not to_evaluate.loc[previous_idx, col].equals(previous_results[col])
-        ]
-        if bad_cols:
-            raise ValueError(
-                f"The following columns have different values from the DataBase: {bad_cols}"
-            )
-        to_evaluate.loc[previous_results.index] = previous_results.loc[previous_results.index]
-        task_ids = task_ids.difference(previous_results.index)
+        task_ids = _load_previous_results(db.load(), to_evaluate, df, task_ids)
+    elif cooperative:
+        logger.info("Create SQL database")
+        try:
+            db.create(to_evaluate, if_exists="fail")
+        except (ValueError, OperationalError):  # pragma: no cover
+            # The table was created by another process in the meantime
+            db.reflect("df")
     else:
         logger.info("Create SQL database")
         db.create(to_evaluate)
 
+    if cooperative:
+        db.create_task_queue(
+            to_evaluate.index.tolist(), to_evaluate.index.difference(task_ids).tolist()
+        )
+
     return db, db.get_url(), task_ids
 
 
+def _prepare_sharded_db(db_url, to_evaluate, df, resume, task_ids):
+    """Prepare the sharded db."""
+    from bluepyparallel.database import ShardedDataBase  # pylint: disable=import-outside-toplevel
+
+    db = ShardedDataBase(db_url)
+
+    if resume and db.exists():
+        logger.info("Load data from the sharded SQL database")
+        db.reflect(to_evaluate)
+        task_ids = _load_previous_results(db.load(), to_evaluate, df, task_ids)
+    else:
+        logger.info("Create sharded SQL database")
+        db.create(to_evaluate)
+
+    return db, task_ids
+
+
+def _prepare_checkpoint(checkpoint_path, to_evaluate, resume, task_ids):
+    """Prepare the checkpoint log."""
+    checkpoint = CheckpointLog(checkpoint_path)
+
+    if resume and checkpoint.exists():
+        logger.info("Load data from the checkpoint log")
+        previous_results = checkpoint.load()
+        if not previous_results.empty:
+            previous_results = previous_results.loc[
+                previous_results.index.intersection(to_evaluate.index)
+            ]
+            to_evaluate.loc[previous_results.index, previous_results.columns] = previous_results
+            task_ids = task_ids.difference(previous_results.index)
+    else:
+        logger.info("Create the checkpoint log")
+        checkpoint.create()
+
+    return checkpoint, task_ids
+
+
+def _exception_columns(function_names):
+    """Get the names of the global exception column and of the ones of each function."""
+    return ["exception"] + [f"{name}_exception" for name in function_names]
+
+
+def _check_new_columns(new_columns, parallel_factory, function_names=()):
+    """Check the new columns and add the exception columns."""
+    # Set default new columns
+    if new_columns is None:
+        if isinstance(parallel_factory, DaskDataFrameFactory):
+            raise ValueError("The new columns must be provided when using 'DaskDataFrameFactory'")
+        new_columns = []
+
+    # Setup internal and new columns
+    exception_columns = _exception_columns(function_names)
+    for col in new_columns:
+        if col[0] in exception_columns:
+            raise ValueError(f"The '{col[0]}' column can not be one of the new columns")
+    # Don't use append to keep the input as is.
+    return [[col, None] for col in exception_columns] + new_columns
+
+
+def _add_new_columns(to_evaluate, new_columns):
+    """Add the new columns filled with their empty values."""
+    for new_column in new_columns:
+        if isinstance(new_column[1], np.ndarray):
+            # The arrays are stored as objects in an array column
+            default = np.empty(1, dtype=object)
+            default[0] = new_column[1]
+            to_evaluate[new_column[0]] = np.repeat(default, len(to_evaluate))
+        else:
+            to_evaluate[new_column[0]] = new_column[1]
+    return to_evaluate
+
+
+def _prepare_space_sink(space, template, resume, db_url, db_shards, checkpoint_path):
+    """Prepare the db or the checkpoint log of a parameter space and get the IDs already done."""
+    # pylint: disable=import-outside-toplevel
+    db = sharded_db = checkpoint = None
+    done_ids = None
+    if checkpoint_path is not None:
+        checkpoint = CheckpointLog(checkpoint_path)
+        if resume and checkpoint.exists():
+            logger.info("Load the IDs of the rows from the checkpoint log")
+            done_ids = checkpoint.load().index
+        else:
+            checkpoint.create()
+    elif db_url is not None:
+        from bluepyparallel.database import DataBase
+        from bluepyparallel.database import ShardedDataBase
+
+        if db_shards:
+            sharded_db = ShardedDataBase(db_url)
+            main_db = sharded_db.main
+            exists = sharded_db.exists()
+        else:
+            db = main_db = DataBase(db_url)
+            exists = db.exists("df")
+
+        if resume and exists:
+            logger.info("Load the IDs of the rows from the SQL database")
+            main_db.reflect("df")
+            if set(main_db.table.columns.keys()) != {main_db.index_col, *template.columns}:
+                raise ValueError(
+                    "The columns of the DataBase are not consistent with the parameter space"
+                )
+            if sharded_db is not None:
+                sharded_db.reflect(template)
+                done_ids = sharded_db.load(columns=[]).index
+            else:
+                done_ids = db.load(columns=[]).index
+        elif sharded_db is not None:
+            sharded_db.create(template)
+        else:
+            db.create(template)
+
+    if done_ids is not None and not space.deterministic:
+        raise ValueError("The parameter space must be deterministic to resume the computation")
+    if done_ids is None:
+        done_ids = []
+    return db, sharded_db, checkpoint, np.sort(np.asarray(done_ids, dtype=np.int64))
+
+
+def _space_chunks(space, done_ids, chunk_size):
+    """Generate the IDs of the rows of a parameter space that are not done, chunk by chunk."""
+    for start in range(0, len(space), chunk_size):
+        stop = min(start + chunk_size, len(space))
+        first_done, last_done = np.searchsorted(done_ids, [start, stop])
+        ids = np.arange(start, stop)
+        ids = ids[~np.isin(ids, done_ids[first_done:last_done])]
+        if len(ids) > 0:
+            yield ids
+
+
+def _evaluate_space_rows(
+    space,
+    chunks,
+    mapper,
+    writer,
+    checkpoint,
+    shard_writer,
+    progress,
+    evaluation_function,
+    func_args,
+    func_kwargs,
+    memory_estimate=None,
+):
+    """Evaluate the rows of a parameter space with a single call to the mapper.
+
+    The rows are generated chunk by chunk when the mapper consumes them, and only the input values
+    of the rows whose result was not received yet are kept to write the results into the DB.
+    """
+    # pylint: disable=too-many-arguments
+    inputs = {}
+
+    def _tasks():
+        for ids in chunks:
+            for task_id, row in space.rows(ids).to_dict("index").items():
+                inputs[task_id] = row
+                yield task_id, row
+
+    eval_func = partial(
+        _try_evaluation,
+        evaluation_function=evaluation_function,
+        func_args=func_args,
+        func_kwargs=func_kwargs,
+        shard_writer=shard_writer,
+    )
+
+    # The memory estimates are computed from the same rows, which are only generated once
+    tasks = _tasks()
+    mapper_kwargs = {}
+    if memory_estimate is not None:
+        tasks, estimated_tasks = itertools.tee(tasks)
+        if callable(memory_estimate):
+            estimates = (memory_estimate(row) for _, row in estimated_tasks)
+        else:
+            estimates = (row[memory_estimate] for _, row in estimated_tasks)
+        mapper_kwargs["memory_estimates"] = estimates
+
+    res = []
+    try:
+        for task_id, result, exception in mapper(eval_func, tasks, **mapper_kwargs):
+            res.append(dict({"df_index": task_id, "exception": exception}, **result))
+            row = inputs.pop(task_id)
+            if writer is not None:
+                writer.write(task_id, result, exception, **row)
+            if checkpoint is not None:
+                checkpoint.append(task_id, dict(result, exception=exception))
+            progress.update()
+    except (KeyboardInterrupt, SystemExit) as ex:
+        # To save the results even if the program is killed
+        logger.warning("Stopping mapper loop. Reason: %r", ex)
+    return res
+
+
+def _evaluate_space_chunks(space, chunks, new_columns, mapper, writer, progress, **eval_kwargs):
+    """Evaluate the rows of a parameter space chunk by chunk with a dask.dataframe mapper.
+
+    The mapper of :class:`bluepyparallel.parallel.DaskDataFrameFactory` needs a DataFrame, so the
+    rows of each chunk are generated and evaluated before the next chunk.
+    """
+    res = []
+    for ids in chunks:
+        to_evaluate = space.rows(ids)
+        res_df = _evaluate_dataframe(
+            to_evaluate,
+            space.columns,
+            new_columns=new_columns,
+            mapper=mapper,
+            task_ids=to_evaluate.index,
+            db=writer,
+            **eval_kwargs,
+        )
+        res.extend(res_df.rename_axis("df_index").reset_index().to_dict("records"))
+        progress.update(len(res_df))
+
+        # The computation was interrupted
+        if len(res_df) < len(ids):
+            break
+    return res
+
+
+def _evaluate_space(
+    space,
+    new_columns,
+    parallel_factory,
+    mapper_kwargs,
+    resume,
+    db_url,
+    db_shards,
+    checkpoint_path,
+    writer_kwargs,
+    progress_bar,
+    **eval_kwargs,
+):
+    """Evaluate the rows of a parameter space that are generated on the fly.
+
+    The rows are generated chunk by chunk when the mapper consumes them, so only the rows being
+    evaluated are stored in memory, and only the computed rows are returned.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    template = _add_new_columns(space.rows(np.arange(min(1, len(space)))), new_columns)
+    db, sharded_db, checkpoint, done_ids = _prepare_space_sink(
+        space, template, resume, db_url, db_shards, checkpoint_path
+    )
+    nb_rows = len(space) - ((done_ids >= 0) & (done_ids < len(space))).sum()
+    logger.info("%s rows to compute.", nb_rows)
+
+    writer = db.batch_writer(**writer_kwargs) if db is not None else None
+    shard_writer = sharded_db.shard_writer() if sharded_db is not None else None
+    chunks = _space_chunks(space, done_ids, parallel_factory.batch_size or _SPACE_CHUNK_SIZE)
+
+    progress = tqdm(total=nb_rows, disable=not progress_bar)
+    try:
+        if isinstance(parallel_factory, DaskDataFrameFactory):
+            mapper_kwargs["progress_bar"] = False
+            eval_kwargs.pop("memory_estimate")
+            res = _evaluate_space_chunks(
+                space,
+                chunks,
+                new_columns,
+                parallel_factory.get_mapper(**mapper_kwargs),
+                writer,
+                progress,
+                checkpoint=checkpoint,
+                shard_writer=shard_writer,
+                **eval_kwargs,
+            )
+        else:
+            res = _evaluate_space_rows(
+                space,
+                chunks,
+                parallel_factory.get_mapper(**mapper_kwargs),
+                writer,
+                checkpoint,
+                shard_writer,
+                progress,
+                **eval_kwargs,
+            )
+    finally:
+        progress.close()
+        if writer is not None:
+            writer.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if sharded_db is not None:
+            sharded_db.merge()
+
+    if not res:
+        logger.warning("WARNING: No row to compute, something may be wrong")
+        return template.iloc[:0]
+
+    # Generate the input values of the computed rows again to build the output DataFrame
+    res_df = pd.DataFrame(res).set_index("df_index")
+    to_evaluate = _add_new_columns(space.rows(res_df.index), new_columns)
+    to_evaluate.loc[res_df.index, res_df.columns] = res_df
+    return to_evaluate
+
+
+def _deduplicate(to_evaluate, input_cols, task_ids):
+    """Find the rows whose input values are the same as the ones of a previous row.
+
+    Return:
+        tuple: the IDs of the distinct rows and a Series mapping the IDs of the duplicated rows to
+        the IDs of the rows they duplicate.
+    """
+    try:
+        hashes = pd.util.hash_pandas_object(to_evaluate.loc[task_ids, input_cols], index=False)
+    except TypeError as exc:
+        raise ValueError(
+            "The 'dedup' argument can only be used with input values that can be hashed"
+        ) from exc
+    duplicated = hashes.duplicated()
+    first_ids = pd.Series(hashes.index[~duplicated], index=hashes[~duplicated].values)
+    duplicates = pd.Series(
+        first_ids.loc[hashes[duplicated].values].values, index=hashes.index[duplicated]
+    )
+    return task_ids[~duplicated.values], duplicates
+
+
+def _fan_out_duplicates(to_evaluate, input_cols, res_df, duplicates, db, checkpoint):
+    """Copy the results to the duplicated rows and save them into the DB or the checkpoint log."""
+    duplicates = duplicates[duplicates.isin(res_df.index)]
+    if duplicates.empty:
+        return res_df
+    duplicated_df = res_df.loc[duplicates.values].set_axis(duplicates.index, axis=0)
+
+    if db is not None:
+        batch_complete = to_evaluate.loc[duplicated_df.index, input_cols].join(duplicated_df)
+        db.write_batch(batch_complete.columns.tolist(), batch_complete.to_records().tolist())
+
+    if checkpoint is not None:
+        for task_id, values in duplicated_df.to_dict("index").items():
+            checkpoint.append(task_id, values)
+
+    return pd.concat([res_df, duplicated_df])
+
+
+def _evaluate_cooperative(evaluate_tasks, db, claim_size, lease_duration, writer):
+    """Evaluate the tasks claimed from the task queue of the DB until no task is pending."""
+    res = []
+    while True:
+        task_ids = db.claim_tasks(claim_size, lease_duration)
+        if not task_ids:
+            # The claim may fail because another process claimed the same tasks at the same time
+            if db.count_pending_tasks():
+                continue
+            break
+        logger.info("Claimed %s rows from the task queue", len(task_ids))
+
+        res_df = evaluate_tasks(task_ids=pd.Index(task_ids))
+        res.append(res_df)
+
+        # The results are committed in the same transaction as the tasks marked as done
+        writer.complete_tasks(res_df.index.tolist())
+
+        # The computation was interrupted, the remaining claimed tasks will be reclaimed by
+        # another process when their lease expires
+        if len(res_df) < len(task_ids):
+            break
+
+    if not res:
+        return pd.DataFrame()
+    return pd.concat(res)
+
+
 def evaluate(
     df,
     evaluation_function,
@@ -175,17 +667,42 @@ def evaluate(
     func_kwargs=None,
     shuffle_rows=True,
     progress_bar=True,
+    cooperative=False,
+    claim_size=100,
+    lease_duration=3600,
+    memory_estimate=None,
+    checkpoint_path=None,
+    db_commit_interval=1,
+    db_upsert=False,
+    db_shards=False,
+    dedup=False,
+    context_function=None,
     **mapper_kwargs,
 ):
     """Evaluate and save results in a sqlite database on the fly and return dataframe.
 
     Args:
-        df (pandas.DataFrame): each row contains information for the computation.
-        evaluation_function (callable): function used to evaluate each row,
+        df (pandas.DataFrame or ParameterSpace): each row contains information for the
+            computation. If a :class:`bluepyparallel.parameter_space.ParameterSpace` is given
+            (like a :class:`~bluepyparallel.parameter_space.ParameterGrid`), its rows are generated
+            on the fly by chunks of ``batch_size`` rows (the batch size of the factory or 10000),
+            so the whole DataFrame is never built. Only the rows computed by this call are
+            returned, the ones that were already computed are only skipped when resuming, using
+            the IDs of the rows of the parameter space. In this case, the rows are not shuffled
+            and the ``cooperative`` and ``dedup`` arguments can not be used.
+        evaluation_function (callable or dict): function used to evaluate each row,
             should have a single argument as list-like containing values of the rows of df,
-            and return a dict with keys corresponding to the names in new_columns.
+            and return a dict with keys corresponding to the names in new_columns. A dict of
+            named functions can also be given, in which case all the functions are evaluated on
+            each row in the same task and their results are gathered (so they should return
+            different keys). The exception raised by each function is then stored in the
+            ``<name>_exception`` column, and does not prevent the other functions from being
+            evaluated. When resuming, the rows whose ``<name>_exception`` column is set are
+            stored like the other rows and are thus not computed again.
         new_columns (list): list of names of new column and empty value to save evaluation results,
-            i.e.: :code:`[['result', 0.0], ['valid', False]]`.
+            i.e.: :code:`[['result', 0.0], ['valid', False]]`. The columns whose empty value is a
+            :class:`numpy.ndarray` are stored as compressed arrays in the database and are
+            loaded as :class:`bluepyparallel.arrays.LazyArray` objects when resuming.
         resume (bool): if :obj:`True` and ``db_url`` is provided, it will use only compute the
             missing rows of the database.
         parallel_factory (ParallelFactory or str): parallel factory name or instance.
@@ -198,16 +715,66 @@ def evaluate(
         func_kwargs (dict): the keyword arguments to pass to the evaluation_function.
         shuffle_rows (bool): if :obj:`True`, it will shuffle the rows before computing the results.
         progress_bar (bool): if :obj:`True`, a progress bar will be displayed during computation.
+        cooperative (bool): if :obj:`True`, the rows are evaluated cooperatively by all the
+            processes that call this function with the same ``df`` and ``db_url``. A task queue
+            is stored in the database and each process claims chunks of ``claim_size`` pending
+            rows, evaluates them with its own parallel factory and writes the results, until no
+            row is pending. The rows already evaluated in the database are skipped like with
+            ``resume=True``. Requires ``db_url``.
+        claim_size (int): the number of rows claimed at once in cooperative mode.
+        lease_duration (float): the number of seconds after which the rows claimed by a process
+            that did not complete them (e.g. because it crashed) can be claimed by another one.
+        memory_estimate (str or callable): the name of a column containing the memory required by
+            each row or a function returning this memory from a row. The rows are then only
+            evaluated when their memory fits in the memory budget of the factory, which must be a
+            :class:`MultiprocessingFactory` with a ``memory_budget`` or a :class:`DaskFactory`
+            whose workers have a ``MEMORY`` resource.
+        checkpoint_path (str): the path to a local append-only file in which the results are
+            written by batches. If ``resume`` is :obj:`True` and this file exists, the rows it
+            contains are not computed again. This is cheaper than the SQL backend, so it can be
+            used for many fast evaluations, but the input values are not stored and thus are not
+            checked when resuming. Can not be used with ``db_url``.
+        db_commit_interval (int): the number of writes grouped in each transaction of the
+            database. The results of the last uncommitted writes are lost if the process crashes.
+        db_upsert (bool): if :obj:`True`, the results of the rows that already exist in the
+            database replace the existing ones instead of being inserted again.
+        db_shards (bool): if :obj:`True`, each process of the parallel factory directly writes its
+            results into its own SQLite database (a shard) stored in the ``<db_path>.shards``
+            directory, which avoids sending all the results to a single writer. With
+            ``resume=True``, the rows of the database and of all the shards are not computed
+            again. The shards are merged into the database at the end of the computation. Only
+            SQLite databases are supported, and the shard directory must be accessible to all the
+            workers. Can not be used in cooperative mode.
+        dedup (bool): if :obj:`True`, the rows are hashed according to the values of their input
+            columns and only the first row of each group of identical rows is evaluated. Its
+            results are then copied to the other rows of the group, in the returned DataFrame and
+            in the database or the checkpoint log. The number of rows that were not evaluated is
+            logged. Can not be used in cooperative mode.
+        context_function (callable): function called once on each row before the evaluation
+            functions, whose result is given to each of them as second argument (before
+            ``func_args``). It can be used to share an expensive setup between several
+            functions, like loading the data of the row. If it raises an exception, no function
+            is evaluated on the row and the exception is stored in the ``exception`` column.
         **mapper_kwargs: the keyword arguments are passed to the get_mapper() method of the
             :class:`ParallelFactory` instance.
 
     Return:
         pandas.DataFrame: dataframe with new columns containing the computed results.
     """
-    # pylint: disable=too-many-branches
+    # pylint: disable=too-many-arguments,too-many-branches,too-many-locals,too-many-statements
     # Initialize the parallel factory
     if isinstance(parallel_factory, str) or parallel_factory is None:
         parallel_factory = init_parallel_factory(parallel_factory)
+    if memory_estimate is not None and (
+        not isinstance(parallel_factory, (MultiprocessingFactory, DaskFactory))
+        or isinstance(parallel_factory, DaskDataFrameFactory)
+    ):
+        raise ValueError(
+            "The memory estimates can only be used with 'MultiprocessingFactory' or 'DaskFactory'"
+        )
+    if dedup and cooperative:
+        raise ValueError("The 'dedup' argument can not be used in cooperative mode")
+
     # Set default args
     if func_args is None:
         func_args = []
@@ -216,10 +783,46 @@ def evaluate(
     if func_kwargs is None:
         func_kwargs = {}
 
-    # Drop exception column if present
-    if "exception" in df.columns:
-        logger.warning("The 'exception' column is going to be replaced")
-        df = df.drop(columns=["exception"])
+    if checkpoint_path is not None and db_url is not None:
+        raise ValueError("The 'db_url' and 'checkpoint_path' arguments can not be used together")
+
+    function_names = list(evaluation_function) if isinstance(evaluation_function, Mapping) else []
+    new_columns = _check_new_columns(new_columns, parallel_factory, function_names)
+
+    # Evaluate all the functions and the context function in the same task
+    if function_names or context_function is not None:
+        evaluation_function = partial(
+            _evaluate_functions, functions=evaluation_function, context_function=context_function
+        )
+
+    # Evaluate the rows of the parameter spaces on the fly
+    if isinstance(df, ParameterSpace):
+        if cooperative or dedup:
+            raise ValueError(
+                "The 'cooperative' and 'dedup' arguments can not be used with a parameter space"
+            )
+        return _evaluate_space(
+            df,
+            new_columns,
+            parallel_factory,
+            mapper_kwargs,
+            resume,
+            db_url,
+            db_shards,
+            checkpoint_path,
+            {"commit_interval": db_commit_interval, "upsert": db_upsert},
+            progress_bar,
+            evaluation_function=evaluation_function,
+            func_args=func_args,
+            func_kwargs=func_kwargs,
+            memory_estimate=memory_estimate,
+        )
+
+    # Drop exception columns if present
+    for col in _exception_columns(function_names):
+        if col in df.columns:
+            logger.warning("The '%s' column is going to be replaced", col)
+            df = df.drop(columns=[col])
 
     # Shallow copy the given DataFrame to add internal rows
     to_evaluate = df.copy()
@@ -229,40 +832,64 @@ def evaluate(
 
     task_ids = to_evaluate.index
 
-    # Set default new columns
-    if new_columns is None:
-        if isinstance(parallel_factory, DaskDataFrameFactory):
-            raise ValueError("The new columns must be provided when using 'DaskDataFrameFactory'")
-        new_columns = []
-
     # Setup internal and new columns
-    if any(col[0] == "exception" for col in new_columns):
-        raise ValueError("The 'exception' column can not be one of the new columns")
-    new_columns = [["exception", None]] + new_columns  # Don't use append to keep the input as is.
-    for new_column in new_columns:
-        to_evaluate[new_column[0]] = new_column[1]
+    to_evaluate = _add_new_columns(to_evaluate, new_columns)
+
+    # Create the database or the checkpoint log if required and get the task ids to run
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint, task_ids = _prepare_checkpoint(checkpoint_path, to_evaluate, resume, task_ids)
 
-    # Create the database if required and get the task ids to run
+    sharded_db = None
     if db_url is None:
+        if cooperative:
+            raise ValueError("The 'db_url' argument must be provided in cooperative mode")
         logger.info("Not using SQL backend to save iterations")
         db = None
+    elif db_shards:
+        if cooperative:
+            raise ValueError("The 'db_shards' argument can not be used in cooperative mode")
+        db = None
+        sharded_db, task_ids = _prepare_sharded_db(db_url, to_evaluate, df, resume, task_ids)
+    else:
+        db, db_url, task_ids = _prepare_db(db_url, to_evaluate, df, resume, task_ids, cooperative)
+
+    # Only evaluate the first row of each group of identical rows
+    if dedup:
+        task_ids, duplicates = _deduplicate(to_evaluate, df.columns, task_ids)
+        logger.info("%s duplicated rows will not be evaluated", len(duplicates))
     else:
-        db, db_url, task_ids = _prepare_db(db_url, to_evaluate, df, resume, task_ids)
+        duplicates = None
 
     # Log the number of tasks to run
     if len(task_ids) > 0:
         logger.info("%s rows to compute.", str(len(task_ids)))
     else:
         logger.warning("WARNING: No row to compute, something may be wrong")
+        if sharded_db is not None:
+            sharded_db.merge()
         return to_evaluate
 
+    # Setup the writer used to save the results into the DB
+    if db is not None:
+        writer = db.batch_writer(commit_interval=db_commit_interval, upsert=db_upsert)
+    else:
+        writer = None
+
+    # Setup the writer used by the workers to save the results into the shards
+    if sharded_db is not None:
+        shard_writer = sharded_db.shard_writer()
+    else:
+        shard_writer = None
+
     # Get the factory mapper
     if isinstance(parallel_factory, DaskDataFrameFactory):
         mapper_kwargs["progress_bar"] = progress_bar
     mapper = parallel_factory.get_mapper(**mapper_kwargs)
 
     if isinstance(parallel_factory, DaskDataFrameFactory):
-        res_df = _evaluate_dataframe(
+        evaluate_tasks = partial(
+            _evaluate_dataframe,
             to_evaluate,
             df.columns,
             evaluation_function,
@@ -270,21 +897,47 @@ def evaluate(
             func_kwargs,
             new_columns,
             mapper,
-            task_ids,
-            db,
+            db=writer,
+            checkpoint=checkpoint,
+            shard_writer=shard_writer,
         )
     else:
-        res_df = _evaluate_basic(
+        evaluate_tasks = partial(
+            _evaluate_basic,
             to_evaluate,
             df.columns,
             evaluation_function,
             func_args,
             func_kwargs,
             mapper,
-            task_ids,
-            db,
-            progress_bar,
+            db=writer,
+            progress_bar=progress_bar,
+            memory_estimate=memory_estimate,
+            checkpoint=checkpoint,
+            shard_writer=shard_writer,
         )
+
+    try:
+        if cooperative:
+            res_df = _evaluate_cooperative(evaluate_tasks, db, claim_size, lease_duration, writer)
+        else:
+            res_df = evaluate_tasks(task_ids=task_ids)
+        if duplicates is not None:
+            res_df = _fan_out_duplicates(
+                to_evaluate,
+                df.columns,
+                res_df,
+                duplicates,
+                shard_writer if shard_writer is not None else writer,
+                checkpoint,
+            )
+    finally:
+        if writer is not None:
+            writer.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if sharded_db is not None:
+            sharded_db.merge()
     to_evaluate.loc[res_df.index, res_df.columns] = res_df
 
     if shuffle_rows:
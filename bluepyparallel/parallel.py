@@ -1,4 +1,4 @@
-"""Parallel helper."""
+"""Parallel helper."""  # pylint: disable=too-many-lines
 
 # Copyright 2021-2024 Blue Brain Project / EPFL
 
@@ -14,53 +14,340 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import importlib.metadata
+import atexit
+import glob
+import heapq
+import importlib
 import json
 import logging
+import mmap
 import multiprocessing
 import os
+import pickle
+import queue
+import re
+import sys
+import tempfile
+import threading
+import uuid
 from abc import abstractmethod
+from collections import deque
 from collections.abc import Iterator
 from functools import partial
+from itertools import count
+from itertools import islice
 from multiprocessing.pool import Pool
 
 import numpy as np
-from packaging import version
+from tqdm import tqdm
 
-try:
-    import dask.distributed
-    import dask_mpi
+# The libraries of the parallel backends are slow to import, so they are only imported when a
+# factory that requires them is created (see init_parallel_factory)
+from bluepyparallel.utils import replace_values_in_docstring
 
-    dask_available = True
-except ImportError:  # pragma: no cover
-    dask_available = False
+L = logging.getLogger(__name__)
 
-try:
-    import dask.dataframe as dd  # pylint: disable=ungrouped-imports
-    import pandas as pd
-    from dask.distributed import progress
 
-    dask_df_available = True
-except ImportError:  # pragma: no cover
-    dask_df_available = False
+def _func_wrapper(data, func, func_args, func_kwargs):
+    """Function wrapper used to pass args and kwargs."""
+    return func(data, *func_args, **func_kwargs)
 
-try:
-    import ipyparallel
 
-    ipyparallel_major_version = version.parse(importlib.metadata.version("ipyparallel")).major
+def _evaluate_bundle(bundle, func):
+    """Function wrapper used to evaluate a function on each element of a bundle."""
+    return [func(element) for element in bundle]
 
-    ipyparallel_available = True
-except ImportError:  # pragma: no cover
-    ipyparallel_available = False
 
-from bluepyparallel.utils import replace_values_in_docstring
+if os.path.isdir("/dev/shm"):
+    _SHARED_MEMORY_DIR = "/dev/shm"
+else:  # pragma: no cover
+    _SHARED_MEMORY_DIR = tempfile.gettempdir()
 
-L = logging.getLogger(__name__)
 
+class _OutOfBandResult:
+    """A result pickled with protocol 5 whose large buffers are stored in a shared memory file."""
+
+    __slots__ = ["payload", "path", "sizes"]
+
+    def __init__(self, payload, path=None, sizes=None):
+        self.payload = payload
+        self.path = path
+        self.sizes = sizes
+
+    def load(self):
+        """Unpickle the result, the buffers are mapped from the file without being copied.
+
+        The file is removed once it is mapped (or if it can not be mapped), the memory is thus
+        released when the objects using the buffers are deleted. The mapping is private, so the
+        buffers can be modified without modifying the file.
+        """
+        if self.path is None:
+            return pickle.loads(self.payload)
+
+        try:
+            with open(self.path, "rb") as f:
+                memory = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+        finally:
+            os.remove(self.path)
+
+        buffers = []
+        offset = 0
+        for size in self.sizes:
+            buffers.append(memory[offset : offset + size])
+            offset += size
+        return pickle.loads(self.payload, buffers=buffers)
+
+
+def _out_of_band_wrapper(data, func, threshold, prefix="bluepyparallel_"):
+    """Function wrapper used to send the large buffers of the result out-of-band.
+
+    The result is pickled with protocol 5 and the buffers larger than ``threshold`` bytes (e.g.
+    the data of the NumPy arrays) are written into a file of the shared memory whose name starts
+    with ``prefix``, so they are not copied into the pickle stream sent to the parent process.
+    """
+    buffers = []
+
+    def _buffer_callback(buffer):
+        nbytes = buffer.raw().nbytes
+        if nbytes == 0 or nbytes < threshold:
+            return True
+        buffers.append(buffer.raw())
+        return False
+
+    payload = pickle.dumps(func(data), protocol=5, buffer_callback=_buffer_callback)
+    if not buffers:
+        return _OutOfBandResult(payload)
+
+    fd, path = tempfile.mkstemp(prefix=prefix, dir=_SHARED_MEMORY_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for buffer in buffers:
+                f.write(buffer)
+    except BaseException:
+        # The shared memory is full or the worker is interrupted
+        os.remove(path)
+        raise
+    return _OutOfBandResult(payload, path, [buffer.nbytes for buffer in buffers])
+
+
+def _remove_shared_memory_files(prefix):
+    """Remove the files of the shared memory whose name starts with the given prefix."""
+    for path in glob.glob(os.path.join(_SHARED_MEMORY_DIR, glob.escape(prefix) + "*")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # pragma: no cover
+            pass
+
+
+_CPU_BUDGET = "PARALLEL_CPU_BUDGET"
+_THREADS_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+def get_cpu_budget():
+    """Return the number of CPUs that the current process and its children may use.
+
+    This is the value of the ``PARALLEL_CPU_BUDGET`` environment variable, which is set in the
+    workers of the process pools, or the number of CPUs available to the current process.
+    """
+    budget = int(os.getenv(_CPU_BUDGET, "0"))
+    if budget:
+        return budget
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        return os.cpu_count()
+
+
+def _set_cpu_budget(budget):
+    """Set the CPU budget of the current process and limit the threads of the usual libraries.
+
+    The thread limits that are already set to a value lower than the budget (e.g. by the user) are
+    kept, the other ones are set to the budget.
+    """
+    os.environ[_CPU_BUDGET] = str(budget)
+    threads = budget
+    for env_var in _THREADS_ENV_VARS:
+        value = os.getenv(env_var, "")
+        if value.isdigit() and 0 < int(value) <= budget:
+            threads = min(threads, int(value))
+        else:
+            os.environ[env_var] = str(budget)
+
+    # The environment variables have no effect on the libraries that are already loaded
+    try:
+        from threadpoolctl import threadpool_limits  # pylint: disable=import-outside-toplevel
+    except ImportError:  # pragma: no cover
+        return
+    threadpool_limits(threads)  # pragma: no cover
+
+
+def _parse_cpu_list(cpu_list):
+    """Parse a CPU list like ``0-3,8,10-11`` into a list of CPU IDs."""
+    cpus = []
+    for cpu_range in cpu_list.strip().split(","):
+        if not cpu_range:
+            continue
+        first, _, last = cpu_range.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _numa_nodes():
+    """Return the lists of CPUs available to the current process in each NUMA node."""
+    available = os.sched_getaffinity(0)
+    nodes = []
+    for path in sorted(
+        glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"),
+        key=lambda path: int(re.search(r"node(\d+)", path).group(1)),
+    ):
+        with open(path, encoding="utf-8") as file:
+            cpus = [cpu for cpu in _parse_cpu_list(file.read()) if cpu in available]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(available)]
+
+
+def _compute_core_sets(processes, affinity, nodes=None):
+    """Compute the set of CPUs assigned to each of the given number of processes.
+
+    With ``affinity="pack"``, the processes fill the NUMA nodes one after the other. With
+    ``affinity="spread"``, the processes are distributed over the NUMA nodes in a round-robin way.
+    In both cases, the CPUs are evenly shared between the processes of the same NUMA node.
+    """
+    if nodes is None:
+        nodes = _numa_nodes()
+
+    if affinity == "pack":
+        cpus = [cpu for node in nodes for cpu in node]
+        nb_cpus = max(len(cpus) // processes, 1)
+        return [
+            [cpus[(num * nb_cpus + i) % len(cpus)] for i in range(nb_cpus)]
+            for num in range(processes)
+        ]
+
+    if affinity == "spread":
+        core_sets = []
+        for num in range(processes):
+            node_num = num % len(nodes)
+            node = nodes[node_num]
+            nb_node_processes = len(range(node_num, processes, len(nodes)))
+            nb_cpus = max(len(node) // nb_node_processes, 1)
+            rank = num // len(nodes)
+            core_sets.append([node[(rank * nb_cpus + i) % len(node)] for i in range(nb_cpus)])
+        return core_sets
+
+    raise ValueError(f"The affinity must be one of ['pack', 'spread'] but is '{affinity}'")
+
+
+def _is_alive(pid):
+    """Check whether a process is alive."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # pragma: no cover
+        pass
+    return True
 
-def _func_wrapper(data, func, func_args, func_kwargs):
-    """Function wrapper used to pass args and kwargs."""
-    return func(data, *func_args, **func_kwargs)
+
+def _claim_slot(slot_owners):
+    """Claim a free slot for the current process and return its number.
+
+    The slots contain the PID of the process using them. A slot is free if it was never used or if
+    its process is not alive anymore (e.g. because it was replaced after ``maxtasksperchild`` tasks
+    or because it crashed).
+    """
+    with slot_owners.get_lock():
+        for slot, pid in enumerate(slot_owners):
+            if pid == 0 or not _is_alive(pid):
+                slot_owners[slot] = os.getpid()
+                return slot
+    # All the slots are used by living processes
+    return os.getpid() % len(slot_owners)  # pragma: no cover
+
+
+def _init_pool_worker(budget, initializer=None, initargs=(), core_sets=None, slot_owners=None):
+    """Set the CPU budget and affinity of a pool worker then call the given initializer."""
+    if core_sets is not None:
+        cpus = core_sets[_claim_slot(slot_owners)]
+        os.sched_setaffinity(0, cpus)
+        budget = len(cpus)
+        L.debug("Worker %s pinned to the CPUs %s", os.getpid(), cpus)
+
+    _set_cpu_budget(budget)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+_LOCAL_POOLS = {}
+_LOCAL_POOLS_LOCK = threading.Lock()
+_PUSHED_FUNCS = {}
+
+
+def _push_function(key, func):
+    """Store a function in the current process so it can be used by the next tasks."""
+    _PUSHED_FUNCS[key] = func
+
+
+def _remove_function(key):
+    """Remove a function stored in the current process."""
+    _PUSHED_FUNCS.pop(key, None)
+
+
+def _evaluate_pushed_bundle(bundle, key):
+    """Function wrapper used to evaluate a stored function on each element of a bundle."""
+    return _evaluate_bundle(bundle, _PUSHED_FUNCS[key])
+
+
+def _evaluate_bundle_in_pool(bundle, func, processes=None):
+    """Function wrapper used to evaluate a function on a bundle using a local process pool.
+
+    The pool is created the first time a bundle is evaluated in the current process and is then
+    reused for the next bundles. The workers of dask can run several tasks in parallel threads,
+    so the pool is created under a lock to ensure that only one pool is created. If the number of
+    processes is not given, the CPU budget of the current process is used.
+    """
+    processes = processes or get_cpu_budget()
+    with _LOCAL_POOLS_LOCK:
+        pool = _LOCAL_POOLS.get(processes)
+        if pool is None:
+            pool = _LOCAL_POOLS[processes] = NestedPool(processes=processes)
+    return pool.map(func, bundle)
+
+
+@atexit.register
+def _close_local_pools():
+    """Close the local process pools of the current process."""
+    with _LOCAL_POOLS_LOCK:
+        while _LOCAL_POOLS:
+            _, pool = _LOCAL_POOLS.popitem()
+            pool.close()
+            pool.join()
+
+
+def _check_memory_estimates(memory_estimates):
+    """Check that the memory estimates are non-negative numbers and return them as a list."""
+    memory_estimates = list(memory_estimates)
+    for estimate in memory_estimates:
+        # The NaN values are not greater than or equal to 0
+        if not estimate >= 0:
+            raise ValueError(
+                f"The memory estimates must be non-negative numbers but {estimate} was given"
+            )
+    return memory_estimates
+
+
+def _split_in_bundles(iterable, bundle_size):
+    """Lazily split an iterable into lists of at most bundle_size elements."""
+    iterable = iter(iterable)
+    while bundle := list(islice(iterable, bundle_size)):
+        yield bundle
 
 
 class ParallelFactory:
@@ -68,15 +355,21 @@ class ParallelFactory:
 
     _BATCH_SIZE = "PARALLEL_BATCH_SIZE"
     _CHUNK_SIZE = "PARALLEL_CHUNK_SIZE"
+    _MAX_PENDING_BATCHES = "PARALLEL_MAX_PENDING_BATCHES"
 
     # pylint: disable=unused-argument
-    def __init__(self, batch_size=None, chunk_size=None):
+    def __init__(self, batch_size=None, chunk_size=None, max_pending_batches=None):
         self.batch_size = batch_size or int(os.getenv(self._BATCH_SIZE, "0")) or None
         L.info("Using %s=%s", self._BATCH_SIZE, self.batch_size)
 
         self.chunk_size = batch_size or int(os.getenv(self._CHUNK_SIZE, "0")) or None
         L.info("Using %s=%s", self._CHUNK_SIZE, self.chunk_size)
 
+        self.max_pending_batches = (
+            max_pending_batches or int(os.getenv(self._MAX_PENDING_BATCHES, "0")) or 1
+        )
+        L.info("Using %s=%s", self._MAX_PENDING_BATCHES, self.max_pending_batches)
+
         if not hasattr(self, "nb_processes"):
             self.nb_processes = 1
 
@@ -99,6 +392,12 @@ class ParallelFactory:
         """Wrapper on mapper function creating batches of iterable to give to mapper.
 
         The batch_size is an int corresponding to the number of evaluation in each batch.
+
+        Up to ``max_pending_batches`` batches are given to the mapper before the results of the
+        oldest one are consumed, so the next batches can be submitted while the last tasks of the
+        current batch are still running. This only has an effect on mappers that submit their
+        tasks when they are called (like the ones of the multiprocessing and dask factories),
+        lazy mappers still process the batches one after the other.
         """
         if isinstance(iterable, Iterator):
             iterable = list(iterable)
@@ -106,15 +405,24 @@ class ParallelFactory:
         batch_size = batch_size or self.batch_size
         if batch_size is not None:
             iterables = np.array_split(iterable, len(iterable) // min(batch_size, len(iterable)))
-            if not isinstance(iterable, (pd.DataFrame, pd.Series)):
+
+            # The iterable can only be a pandas object if pandas was already imported
+            pd = sys.modules.get("pandas")
+            if pd is None or not isinstance(iterable, (pd.DataFrame, pd.Series)):
                 iterables = [_iterable.tolist() for _iterable in iterables]
         else:
             iterables = [iterable]
 
+        pending_batches = deque()
         for i, _iterable in enumerate(iterables):
             if len(iterables) > 1:
                 L.info("Computing batch %s / %s", i + 1, len(iterables))
-            yield from mapper(func, _iterable)
+            pending_batches.append(mapper(func, _iterable))
+            if len(pending_batches) >= self.max_pending_batches:
+                yield from pending_batches.popleft()
+
+        while pending_batches:
+            yield from pending_batches.popleft()
 
     def _chunksize_to_kwargs(self, chunk_size, kwargs, label="chunk_size"):
         chunk_size = chunk_size or self.chunk_size
@@ -142,10 +450,55 @@ class NoDaemonProcess(multiprocessing.Process):
 
 
 class NestedPool(Pool):  # pylint: disable=abstract-method
-    """Class that represents a MultiProcessing nested pool."""
+    """Class that represents a MultiProcessing nested pool.
+
+    The CPU budget of the current process is shared between the processes of the pool, so the
+    pools created inside these processes and the thread pools of the libraries like OpenMP or BLAS
+    do not use more CPUs than the ones available.
+
+    If ``affinity`` is given (``"pack"`` or ``"spread"``), each process is pinned to a set of CPUs
+    and its CPU budget is the number of CPUs in this set. The children of the processes inherit
+    this affinity. The ``affinity`` argument is keyword-only, so the other positional arguments are
+    the same as the ones of :class:`multiprocessing.pool.Pool`.
+    """
 
     Process = NoDaemonProcess
 
+    def __init__(self, processes=None, initializer=None, initargs=(), *, affinity=None, **kwargs):
+        """Start the processes with their share of the CPU budget."""
+        cpu_budget = get_cpu_budget()
+        processes = processes or cpu_budget
+        worker_budget = max(cpu_budget // processes, 1)
+        L.info(
+            "Starting %s processes using %s CPUs each (CPU budget: %s)",
+            processes,
+            worker_budget,
+            cpu_budget,
+        )
+
+        if affinity is not None:
+            self.core_sets = _compute_core_sets(processes, affinity)
+            L.info("Pinning the processes to the CPUs %s", self.core_sets)
+            # The workers that replace the exited ones take their core sets
+            slot_owners = multiprocessing.Array("i", len(self.core_sets))
+        else:
+            self.core_sets = None
+            slot_owners = None
+
+        super().__init__(
+            processes,
+            _init_pool_worker,
+            (worker_budget, initializer, initargs, self.core_sets, slot_owners),
+            **kwargs,
+        )
+
+    def worker_affinities(self):
+        """Return the CPUs on which each process of the pool may run."""
+        return {
+            process.pid: sorted(os.sched_getaffinity(process.pid))
+            for process in self._pool  # pylint: disable=protected-access
+        }
+
 
 class SerialFactory(ParallelFactory):
     """Factory that do not work in parallel."""
@@ -161,66 +514,257 @@ class SerialFactory(ParallelFactory):
 
 
 class MultiprocessingFactory(ParallelFactory):
-    """Parallel helper class using multiprocessing."""
+    """Parallel helper class using multiprocessing.
+
+    If ``affinity`` is given (or the ``PARALLEL_AFFINITY`` environment variable is set), each
+    process is pinned to a set of CPUs. With ``affinity="pack"``, the processes fill the NUMA nodes
+    one after the other, while with ``affinity="spread"`` they are distributed over all the NUMA
+    nodes. The actual placement of the processes is returned by :meth:`worker_affinities`.
+
+    If ``memory_budget`` is given (or the ``PARALLEL_MEMORY_BUDGET`` environment variable is set),
+    it is possible to pass the estimated memory required by each element to the mapper (see
+    :meth:`get_mapper`). The tasks are then only submitted when the sum of the estimates of the
+    running tasks fits in this budget.
+
+    If ``out_of_band_threshold`` is given (or the ``PARALLEL_OUT_OF_BAND_THRESHOLD`` environment
+    variable is set), the results are pickled with protocol 5 and the buffers larger than this
+    number of bytes (e.g. the data of large NumPy arrays) are sent through the shared memory
+    instead of the pickle stream. They are then mapped by the parent process without being
+    copied, which reduces the time and the peak memory required to gather large results. If the
+    results are not all consumed (e.g. because the computation is interrupted), the files of the
+    results that were not loaded are removed when the mapper is closed, and the files of the
+    tasks that were still running are removed when the factory is shut down.
+    """
 
     _CHUNKSIZE = "PARALLEL_CHUNKSIZE"
+    _AFFINITY = "PARALLEL_AFFINITY"
+    _MEMORY_BUDGET = "PARALLEL_MEMORY_BUDGET"
+    _OUT_OF_BAND_THRESHOLD = "PARALLEL_OUT_OF_BAND_THRESHOLD"
 
-    def __init__(self, batch_size=None, chunk_size=None, processes=None, **kwargs):
+    def __init__(
+        self,
+        batch_size=None,
+        chunk_size=None,
+        processes=None,
+        max_pending_batches=None,
+        affinity=None,
+        memory_budget=None,
+        out_of_band_threshold=None,
+        **kwargs,
+    ):
         """Initialize multiprocessing factory."""
-        super().__init__(batch_size, chunk_size)
+        self._interrupted_prefixes = []
+        super().__init__(batch_size, chunk_size, max_pending_batches)
+
+        self.nb_processes = processes or get_cpu_budget()
+        self.affinity = affinity or os.getenv(self._AFFINITY) or None
+        L.info("Using %s=%s", self._AFFINITY, self.affinity)
+        self.memory_budget = memory_budget or float(os.getenv(self._MEMORY_BUDGET, "0")) or None
+        L.info("Using %s=%s", self._MEMORY_BUDGET, self.memory_budget)
+        self.out_of_band_threshold = (
+            out_of_band_threshold or int(os.getenv(self._OUT_OF_BAND_THRESHOLD, "0")) or None
+        )
+        L.info("Using %s=%s", self._OUT_OF_BAND_THRESHOLD, self.out_of_band_threshold)
+        self.pool = NestedPool(processes=self.nb_processes, affinity=self.affinity, **kwargs)
 
-        self.nb_processes = processes or os.cpu_count()
-        self.pool = NestedPool(processes=self.nb_processes, **kwargs)
+    def worker_affinities(self):
+        """Return the CPUs on which each process of the pool may run."""
+        return self.pool.worker_affinities()
+
+    def _admitted_results(self, func, iterable, memory_estimates):
+        """Submit the tasks whose estimated memory fits in the budget and yield their results.
+
+        At most one task per process is running at the same time. When the next task does not fit
+        in the remaining budget, it is deferred and the following ones that fit are submitted first
+        so the small tasks keep running around the large ones. The deferred tasks are submitted
+        from the smallest one as soon as they fit, and a task larger than the whole budget is only
+        submitted when no other task is running.
+        """
+        pending = deque(zip(iterable, _check_memory_estimates(memory_estimates)))
+        deferred = []
+        order = count()
+        completed = queue.SimpleQueue()
+
+        def _completed(result, estimate, exception=None):
+            completed.put((result, estimate, exception))
+
+        used_memory = 0
+        nb_running = 0
+
+        while pending or deferred or nb_running > 0:
+            while nb_running < self.nb_processes:
+                if deferred and (
+                    nb_running == 0 or used_memory + deferred[0][0] <= self.memory_budget
+                ):
+                    estimate, _, element = heapq.heappop(deferred)
+                elif pending:
+                    element, estimate = pending.popleft()
+                    if nb_running > 0 and used_memory + estimate > self.memory_budget:
+                        heapq.heappush(deferred, (estimate, next(order), element))
+                        continue
+                else:
+                    break
+                self.pool.apply_async(
+                    func,
+                    (element,),
+                    callback=partial(_completed, estimate=estimate),
+                    error_callback=partial(_completed, None, estimate),
+                )
+                used_memory += estimate
+                nb_running += 1
+
+            result, estimate, exception = completed.get()
+            used_memory -= estimate
+            nb_running -= 1
+            if exception is not None:
+                raise exception
+            yield result
 
     def get_mapper(self, batch_size=None, chunk_size=None, **kwargs):
-        """Get a NestedPool."""
+        """Get a NestedPool.
+
+        If ``memory_estimates`` is passed as keyword argument to the mapper, it should contain the
+        estimated memory required by each element and the tasks are submitted according to the
+        memory budget of the factory. In this case, the elements are not split into batches.
+        """
         self._chunksize_to_kwargs(chunk_size, kwargs, label="chunksize")
 
-        def _mapper(func, iterable, *func_args, **func_kwargs):
+        def _mapper(func, iterable, *func_args, memory_estimates=None, **func_kwargs):
             mapped_func = self.mappable_func(func, *func_args, **func_kwargs)
-            return self._with_batches(
-                partial(self.pool.imap_unordered, **kwargs),
-                mapped_func,
-                iterable,
-            )
+            if self.out_of_band_threshold is not None:
+                prefix = f"bluepyparallel_{uuid.uuid4().hex}_"
+                mapped_func = partial(
+                    _out_of_band_wrapper,
+                    func=mapped_func,
+                    threshold=self.out_of_band_threshold,
+                    prefix=prefix,
+                )
+
+            if memory_estimates is not None:
+                if self.memory_budget is None:
+                    raise ValueError("The memory budget of the factory must be set")
+                results = self._admitted_results(mapped_func, iterable, memory_estimates)
+            else:
+                results = self._with_batches(
+                    partial(self.pool.imap_unordered, **kwargs),
+                    mapped_func,
+                    iterable,
+                )
+
+            if self.out_of_band_threshold is not None:
+                return self._load_out_of_band(results, prefix)
+            return results
 
         return _mapper
 
+    def _load_out_of_band(self, results, prefix):
+        """Load the out-of-band results and remove the files of the ones that are not loaded."""
+        completed = False
+        try:
+            for result in results:
+                yield result.load()
+            completed = True
+        finally:
+            _remove_shared_memory_files(prefix)
+            if not completed:
+                # The tasks that are still running may create new files
+                self._interrupted_prefixes.append(prefix)
+
     def shutdown(self):
-        """Close the pool."""
+        """Close the pool and remove the shared memory files of the interrupted mappers."""
         try:
             self.pool.close()
         except Exception:  # pylint: disable=broad-except ; # pragma: no cover
             pass
+        for prefix in getattr(self, "_interrupted_prefixes", []):
+            _remove_shared_memory_files(prefix)
 
 
 class IPyParallelFactory(ParallelFactory):
-    """Parallel helper class using ipyparallel."""
+    """Parallel helper class using ipyparallel.
+
+    The mapped function and its arguments are sent once to each engine when the mapper is called,
+    then only the elements are sent in chunks of ``chunk_size`` elements (one task per chunk).
+
+    The timings of the tasks are stored in the ``task_timings`` attribute, which is a
+    :class:`collections.deque` containing a dict for each chunk with the ID of the engine, the
+    number of elements, the submission, start and completion dates and the duration of the task in
+    seconds. Only the timings of the last ``max_task_timings`` chunks are kept.
+    """
 
     _IPYTHON_PROFILE = "IPYTHON_PROFILE"
 
-    def __init__(self, batch_size=None, chunk_size=None, profile=None, **kwargs):
+    def __init__(
+        self,
+        batch_size=None,
+        chunk_size=None,
+        profile=None,
+        max_pending_batches=None,
+        max_task_timings=10000,
+        **kwargs,
+    ):
         """Initialize the ipyparallel factory."""
+        import ipyparallel  # pylint: disable=import-outside-toplevel
+
         profile = profile or os.getenv(self._IPYTHON_PROFILE, None)
         L.debug("Using %s=%s", self._IPYTHON_PROFILE, profile)
         self.rc = ipyparallel.Client(profile=profile, **kwargs)
         self.nb_processes = len(self.rc.ids)
+        self.dview = self.rc[:]
         self.lview = self.rc.load_balanced_view()
-        super().__init__(batch_size, chunk_size)
+        self.task_timings = deque(maxlen=max_task_timings)
+        super().__init__(batch_size, chunk_size, max_pending_batches)
+
+    def _ipp_results(self, key, iterable, chunk_size, **kwargs):
+        """Submit the chunks and return a generator of their results."""
+        chunks = list(_split_in_bundles(iterable, chunk_size))
+        async_results = self.lview.map(
+            partial(_evaluate_pushed_bundle, key=key), chunks, block=False, **kwargs
+        )
+
+        def _results():
+            for bundle_results in async_results:
+                yield from bundle_results
+
+            for chunk, metadata in zip(chunks, async_results.metadata):
+                self.task_timings.append(
+                    {
+                        "engine_id": metadata["engine_id"],
+                        "nb_elements": len(chunk),
+                        "submitted": metadata["submitted"],
+                        "started": metadata["started"],
+                        "completed": metadata["completed"],
+                        "duration": (metadata["completed"] - metadata["started"]).total_seconds(),
+                    }
+                )
+
+        return _results()
 
     def get_mapper(self, batch_size=None, chunk_size=None, **kwargs):
         """Get an ipyparallel mapper using the profile name provided."""
         if "ordered" not in kwargs:  # pragma: no cover
             kwargs["ordered"] = False
-
-        if ipyparallel_major_version < 7:  # pragma: no cover
-            self._chunksize_to_kwargs(chunk_size, kwargs)
+        chunk_size = chunk_size or self.chunk_size or 1
 
         def _mapper(func, iterable, *func_args, **func_kwargs):
             mapped_func = self.mappable_func(func, *func_args, **func_kwargs)
-            return self._with_batches(
-                partial(self.lview.imap, **kwargs), mapped_func, iterable, batch_size=batch_size
-            )
+
+            # Send the function and its arguments to all the engines only once
+            key = uuid.uuid4().hex
+            self.dview.apply_sync(_push_function, key, mapped_func)
+
+            def _results():
+                try:
+                    yield from self._with_batches(
+                        partial(self._ipp_results, chunk_size=chunk_size, **kwargs),
+                        key,
+                        iterable,
+                        batch_size=batch_size,
+                    )
+                finally:
+                    self.dview.apply_async(_remove_function, key)
+
+            return _results()
 
         return _mapper
 
@@ -232,6 +776,123 @@ class IPyParallelFactory(ParallelFactory):
             pass
 
 
+class MPIFactory(ParallelFactory):
+    """Parallel helper class using MPI directly through :mod:`mpi4py`.
+
+    The rank 0 is the master process that runs the main script and dispatches the tasks while the
+    other ranks are the workers. When the factory is created, the workers enter a loop in which
+    they evaluate the tasks they receive and then exit when the factory is shut down. So, like with
+    ``dask_mpi``, everything before the creation of the factory is run on all the ranks.
+
+    The tasks are sent to the workers in chunks of ``chunk_size`` elements and a new chunk is sent
+    to a worker as soon as it returns the results of the previous one, so the load is dynamically
+    balanced between the workers. If there is only one rank, the tasks are evaluated serially.
+    """
+
+    _TAG_TASKS = 1
+    _TAG_RESULTS = 2
+    _TAG_STOP = 3
+
+    def __init__(self, batch_size=None, chunk_size=None, max_pending_batches=None, comm=None):
+        """Initialize the MPI factory."""
+        from mpi4py import MPI  # pylint: disable=import-outside-toplevel
+
+        self.mpi = MPI
+        self.comm = comm or MPI.COMM_WORLD  # pylint: disable=c-extension-no-member
+        self.rank = self.comm.Get_rank()
+        self.nb_processes = max(self.comm.Get_size() - 1, 1)
+        self._stopped = False
+        super().__init__(batch_size, chunk_size, max_pending_batches)
+
+        if self.rank != 0:  # pragma: no cover
+            self._worker_loop()
+            sys.exit(0)
+
+    def _worker_loop(self):  # pragma: no cover
+        """Evaluate the chunks sent by the master until the stop message is received."""
+        status = self.mpi.Status()
+        func = None
+        while True:
+            message = self.comm.recv(source=0, tag=self.mpi.ANY_TAG, status=status)
+            if status.Get_tag() == self._TAG_STOP:
+                break
+
+            # The function is only sent with the first chunk of each mapper call
+            new_func, chunk = message
+            if new_func is not None:
+                func = new_func
+            try:
+                results = _evaluate_bundle(chunk, func)
+            except Exception as exc:  # pylint: disable=broad-except
+                results = exc
+            self.comm.send(results, dest=0, tag=self._TAG_RESULTS)
+
+    def _mpi_results(self, func, iterable, chunk_size):
+        """Dispatch the chunks to the workers and yield the results in completion order."""
+        chunks = _split_in_bundles(iterable, chunk_size)
+        if self.comm.Get_size() < 2:
+            for chunk in chunks:
+                yield from _evaluate_bundle(chunk, func)
+        else:  # pragma: no cover
+            yield from self._dispatch_chunks(func, chunks)
+
+    def _dispatch_chunks(self, func, chunks):  # pragma: no cover
+        """Send the chunks to the workers with dynamic load balancing and yield the results."""
+        # Send a first chunk to each worker
+        nb_running = 0
+        for worker in range(1, self.comm.Get_size()):
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            self.comm.send((func, chunk), dest=worker, tag=self._TAG_TASKS)
+            nb_running += 1
+
+        status = self.mpi.Status()
+        try:
+            while nb_running > 0:
+                results = self.comm.recv(
+                    source=self.mpi.ANY_SOURCE, tag=self._TAG_RESULTS, status=status
+                )
+                nb_running -= 1
+
+                # Send the next chunk to the worker that just finished
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    self.comm.send((None, chunk), dest=status.Get_source(), tag=self._TAG_TASKS)
+                    nb_running += 1
+
+                if isinstance(results, Exception):
+                    raise results
+                yield from results
+        finally:
+            # Wait for the running chunks so their results are not received by the next call
+            for _ in range(nb_running):
+                self.comm.recv(source=self.mpi.ANY_SOURCE, tag=self._TAG_RESULTS)
+
+    def get_mapper(self, batch_size=None, chunk_size=None, **kwargs):
+        """Get a MPI mapper."""
+        chunk_size = chunk_size or self.chunk_size or 1
+
+        def _mapper(func, iterable, *func_args, **func_kwargs):
+            mapped_func = self.mappable_func(func, *func_args, **func_kwargs)
+            return self._with_batches(
+                partial(self._mpi_results, chunk_size=chunk_size),
+                mapped_func,
+                iterable,
+                batch_size=batch_size,
+            )
+
+        return _mapper
+
+    def shutdown(self):
+        """Stop the workers."""
+        if self._stopped or self.rank != 0:
+            return
+        self._stopped = True
+        for worker in range(1, self.comm.Get_size()):  # pragma: no cover
+            self.comm.send(None, dest=worker, tag=self._TAG_STOP)
+
+
 _DEFAULT_DASK_CONFIG = {
     "distributed": {
         "worker": {
@@ -282,10 +943,23 @@ If no config is provided, the following is used:
 class DaskFactory(ParallelFactory):
     """Parallel helper class using dask.
 
+    If ``tasks_per_worker`` is given (or the ``PARALLEL_DASK_TASKS_PER_WORKER`` environment
+    variable is set), only ``tasks_per_worker`` times the number of workers tasks are submitted to
+    the scheduler at the same time and new tasks are submitted as soon as results are received.
+    This keeps the memory used by the scheduler and the client bounded, so it is not required to
+    split the computation into batches.
+
+    If ``bundle_size`` is given (or the ``PARALLEL_DASK_BUNDLE_SIZE`` environment variable is set),
+    each dask task evaluates ``bundle_size`` elements in a loop on the worker and the results are
+    unbundled by the mapper. This amortizes the overhead of the scheduler for fast functions. Note
+    that ``tasks_per_worker`` then counts bundles instead of single elements.
+
     <external_config_block>
     """
 
     _SCHEDULER_PATH = "PARALLEL_DASK_SCHEDULER_PATH"
+    _TASKS_PER_WORKER = "PARALLEL_DASK_TASKS_PER_WORKER"
+    _BUNDLE_SIZE = "PARALLEL_DASK_BUNDLE_SIZE"
 
     def __init__(
         self,
@@ -294,9 +968,14 @@ class DaskFactory(ParallelFactory):
         scheduler_file=None,
         address=None,
         dask_config=None,
+        max_pending_batches=None,
+        tasks_per_worker=None,
+        bundle_size=None,
         **kwargs,
     ):
         """Initialize the dask factory."""
+        import dask.distributed  # pylint: disable=import-outside-toplevel
+
         # Merge the default config with the existing config (keep existing values)
         new_dask_config = dask.config.merge(_DEFAULT_DASK_CONFIG, dask.config.config)
 
@@ -320,6 +999,8 @@ class DaskFactory(ParallelFactory):
             L.info("Connecting dask_mpi with address %s", address)
         if not dask_scheduler_path and not address:  # pragma: no cover
             self.interactive = False
+            import dask_mpi  # pylint: disable=import-outside-toplevel
+
             dask_mpi.initialize()
             L.info("Starting dask_mpi...")
 
@@ -337,7 +1018,15 @@ class DaskFactory(ParallelFactory):
             comm = MPI.COMM_WORLD  # pylint: disable=c-extension-no-member
             self.nb_processes = comm.Get_size()
 
-        super().__init__(batch_size, chunk_size)
+        self.tasks_per_worker = (
+            tasks_per_worker or int(os.getenv(self._TASKS_PER_WORKER, "0")) or None
+        )
+        L.info("Using %s=%s", self._TASKS_PER_WORKER, self.tasks_per_worker)
+
+        self.bundle_size = bundle_size or int(os.getenv(self._BUNDLE_SIZE, "0")) or None
+        L.info("Using %s=%s", self._BUNDLE_SIZE, self.bundle_size)
+
+        super().__init__(batch_size, chunk_size, max_pending_batches)
 
     def shutdown(self):
         """Close the scheduler and the cluster if it was created by the factory."""
@@ -346,22 +1035,152 @@ class DaskFactory(ParallelFactory):
         except Exception:  # pylint: disable=broad-except ; # pragma: no cover
             pass
 
+    def _submit(self, in_dask_func, elements, with_resources=False, **kwargs):
+        """Submit the tasks of the given elements and return their futures.
+
+        If ``with_resources`` is True, the elements are pairs of an element and its estimated
+        memory, which is given to the scheduler as a ``MEMORY`` resource of the task.
+        """
+        if not with_resources:
+            return self.client.map(in_dask_func, elements, **kwargs)
+        kwargs.pop("batch_size", None)
+        return [
+            self.client.submit(in_dask_func, element, resources={"MEMORY": estimate}, **kwargs)
+            for element, estimate in elements
+        ]
+
+    def _dask_results(self, in_dask_func, iterable, with_resources=False, **kwargs):
+        """Submit the tasks and return a generator of their results in completion order."""
+        from dask.distributed import as_completed  # pylint: disable=import-outside-toplevel
+
+        if self.tasks_per_worker is not None:
+            return self._windowed_dask_results(in_dask_func, iterable, with_resources, **kwargs)
+
+        if isinstance(iterable, Iterator):
+            iterable = list(iterable)
+
+        # The tasks are submitted here so the next batch can be submitted before the results of
+        # the current one are consumed
+        futures = self._submit(in_dask_func, iterable, with_resources, **kwargs)
+        return (result for _future, result in as_completed(futures, with_results=True))
+
+    def _windowed_dask_results(self, in_dask_func, iterable, with_resources=False, **kwargs):
+        """Submit the tasks progressively to keep a bounded number of tasks in the scheduler."""
+        from dask.distributed import as_completed  # pylint: disable=import-outside-toplevel
+
+        iterable = iter(iterable)
+        window_size = self.tasks_per_worker * max(self.nb_processes, 1)
+        futures = self._submit(
+            in_dask_func, list(islice(iterable, window_size)), with_resources, **kwargs
+        )
+        completed = as_completed(futures, with_results=True)
+
+        def _results():
+            for _future, result in completed:
+                for future in self._submit(
+                    in_dask_func, list(islice(iterable, 1)), with_resources, **kwargs
+                ):
+                    completed.add(future)
+                yield result
+
+        return _results()
+
+    def _bundle_func(self, func):
+        """Return the function used to evaluate a bundle in a dask task."""
+        return partial(_evaluate_bundle, func=func)
+
     def get_mapper(self, batch_size=None, chunk_size=None, **kwargs):
-        """Get a Dask mapper."""
+        """Get a Dask mapper.
+
+        If ``memory_estimates`` is passed as keyword argument to the mapper, it should contain the
+        estimated memory required by each element, which is given to the scheduler as a
+        ``MEMORY`` resource of the task. In this case, the workers must be started with a
+        ``MEMORY`` resource equal to their memory budget (e.g. using
+        ``dask worker --resources MEMORY=100e9``). The batches and the ``tasks_per_worker``
+        window are used as without memory estimates, but the elements can not be bundled.
+        """
         self._chunksize_to_kwargs(chunk_size, kwargs, label="batch_size")
 
-        def _mapper(func, iterable, *func_args, **func_kwargs):
+        def _mapper(func, iterable, *func_args, memory_estimates=None, **func_kwargs):
             def _dask_mapper(in_dask_func, iterable):
-                futures = self.client.map(in_dask_func, iterable, **kwargs)
-                for _future, result in dask.distributed.as_completed(futures, with_results=True):
-                    yield result
+                if self.bundle_size is None:
+                    return self._dask_results(in_dask_func, iterable, **kwargs)
+
+                bundle_results = self._dask_results(
+                    self._bundle_func(in_dask_func),
+                    _split_in_bundles(iterable, self.bundle_size),
+                    **kwargs,
+                )
+                return (result for bundle in bundle_results for result in bundle)
 
             mapped_func = self.mappable_func(func, *func_args, **func_kwargs)
+            if memory_estimates is not None:
+                if self.bundle_size is not None:
+                    raise ValueError("The memory estimates can not be used with bundles")
+                elements = list(iterable)
+                memory_estimates = _check_memory_estimates(memory_estimates)
+
+                # The batches are made of the positions of the elements, so the elements and
+                # their estimates are not converted into NumPy arrays
+                def _dask_memory_mapper(in_dask_func, positions):
+                    pairs = [(elements[i], memory_estimates[i]) for i in positions]
+                    return self._dask_results(in_dask_func, pairs, with_resources=True, **kwargs)
+
+                return self._with_batches(
+                    _dask_memory_mapper, mapped_func, list(range(len(elements))), batch_size
+                )
             return self._with_batches(_dask_mapper, mapped_func, iterable, batch_size=batch_size)
 
         return _mapper
 
 
+@replace_values_in_docstring(external_config_block=_DASK_CONFIG_DOCSTRING)
+class DaskPoolFactory(DaskFactory):
+    """Parallel helper class using dask to dispatch bundles to local process pools.
+
+    Each dask task is a bundle of ``bundle_size`` elements that is evaluated by a process pool
+    local to the dask worker. This pool contains ``processes_per_worker`` processes (or the value
+    of the ``PARALLEL_DASK_PROCESSES_PER_WORKER`` environment variable, or the CPU budget of the
+    worker) and is created once in each worker. So only one dask worker should be started per
+    node and the scheduler only sees node-sized tasks while all the cores are used. By default,
+    the bundles contain 4 elements per process of the pool (or of the largest pool if the number
+    of processes depends on the CPU budget of each worker).
+
+    Note that the dask workers are not started as daemon processes so they can create the pools.
+
+    <external_config_block>
+    """
+
+    _PROCESSES_PER_WORKER = "PARALLEL_DASK_PROCESSES_PER_WORKER"
+
+    def __init__(self, *args, processes_per_worker=None, dask_config=None, **kwargs):
+        """Initialize the dask pool factory."""
+        import dask.config  # pylint: disable=import-outside-toplevel
+
+        # The CPU budget of each worker is used if the number of processes is not given
+        self.processes_per_worker = (
+            processes_per_worker or int(os.getenv(self._PROCESSES_PER_WORKER, "0")) or None
+        )
+        L.info("Using %s=%s", self._PROCESSES_PER_WORKER, self.processes_per_worker)
+
+        # Daemon processes can not have children
+        dask_config = dask.config.merge(
+            {"distributed": {"worker": {"daemon": False}}}, dask_config or {}
+        )
+        super().__init__(*args, dask_config=dask_config, **kwargs)
+
+        if self.bundle_size is None:
+            processes = self.processes_per_worker
+            if processes is None:
+                # Use the largest CPU budget of the workers
+                processes = max(self.client.run(get_cpu_budget).values(), default=1)
+            self.bundle_size = 4 * processes
+
+    def _bundle_func(self, func):
+        """Return the function used to evaluate a bundle in a dask task."""
+        return partial(_evaluate_bundle_in_pool, func=func, processes=self.processes_per_worker)
+
+
 @replace_values_in_docstring(external_config_block=_DASK_CONFIG_DOCSTRING)
 class DaskDataFrameFactory(DaskFactory):
     """Parallel helper class using `dask.dataframe`.
@@ -373,6 +1192,8 @@ class DaskDataFrameFactory(DaskFactory):
 
     def _with_batches(self, *args, **kwargs):
         """Specific process for batches."""
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
         for tmp in super()._with_batches(*args, **kwargs):
             if isinstance(tmp, pd.Series):
                 tmp = tmp.to_frame()
@@ -383,21 +1204,49 @@ class DaskDataFrameFactory(DaskFactory):
 
         If ``progress_bar=True`` is passed as keyword argument, a progress bar will be displayed
         during computation.
+
+        The mapper yields the result of each partition as soon as it is computed, so the
+        partitions are yielded in completion order, not in the order of the input data. The
+        results can be sorted by their index to restore the input order.
+
+        By default, the mapped function is applied on each row of the data. If ``by_partition=True``
+        is passed to the mapper, the mapped function is applied once on each partition of the data
+        using :meth:`dask.dataframe.DataFrame.map_partitions` and should return a
+        :class:`pandas.DataFrame` consistent with the given ``meta``.
         """
+        # pylint: disable=import-outside-toplevel
+        import dask.dataframe as dd
+        import pandas as pd
+        from dask.distributed import as_completed
+
         self._chunksize_to_kwargs(chunk_size, kwargs, label="chunksize")
         progress_bar = kwargs.pop("progress_bar", True)
         if not kwargs.get("chunksize"):
             kwargs["npartitions"] = self.nb_processes or 1
 
-        def _mapper(func, iterable, *func_args, meta, **func_kwargs):
+        def _mapper(func, iterable, *func_args, meta, by_partition=False, **func_kwargs):
             def _dask_df_mapper(func, iterable):
                 df = pd.DataFrame(iterable)
                 ddf = dd.from_pandas(df, **kwargs)
-                future = ddf.apply(func, meta=meta, axis=1).persist()
-                if progress_bar:
-                    progress(future)
-                # Put into a list because of the 'yield from' in _with_batches
-                return [future.compute()]
+                if by_partition:
+                    ddf = ddf.map_partitions(func, meta=meta)
+                else:
+                    ddf = ddf.apply(func, meta=meta, axis=1)
+
+                # Each partition is computed in its own future so the results can be gathered
+                # one by one as soon as they are available
+                partitions = self.client.compute(ddf.to_delayed())
+                nb_partitions = len(partitions)
+                completed = as_completed(partitions, with_results=True)
+                del partitions
+
+                def _gather():
+                    results = (result for _future, result in completed)
+                    if progress_bar:
+                        results = tqdm(results, total=nb_partitions)
+                    yield from results
+
+                return _gather()
 
             func = self.mappable_func(func, *func_args, **func_kwargs)
             return self._with_batches(_dask_df_mapper, func, iterable, batch_size=batch_size)
@@ -405,6 +1254,18 @@ class DaskDataFrameFactory(DaskFactory):
         return _mapper
 
 
+# The factories and the libraries they require
+_PARALLEL_FACTORIES = {
+    None: (SerialFactory, []),
+    "multiprocessing": (MultiprocessingFactory, []),
+    "dask": (DaskFactory, ["dask.distributed"]),
+    "dask_pool": (DaskPoolFactory, ["dask.distributed"]),
+    "dask_dataframe": (DaskDataFrameFactory, ["dask.dataframe", "dask.distributed"]),
+    "ipyparallel": (IPyParallelFactory, ["ipyparallel"]),
+    "mpi": (MPIFactory, ["mpi4py"]),
+}
+
+
 def init_parallel_factory(parallel_lib, *args, **kwargs):
     """Return the desired instance of the parallel factory.
 
@@ -413,27 +1274,27 @@ def init_parallel_factory(parallel_lib, *args, **kwargs):
     * None: return a serial mapper (the standard :func:`map` function).
     * multiprocessing: return a mapper using the standard :mod:`multiprocessing`.
     * dask: return a mapper using the :class:`distributed.Client`.
+    * dask_pool: return a mapper using the :class:`distributed.Client` to send bundles of
+      elements to process pools local to the dask workers.
     * ipyparallel: return a mapper using the :mod:`ipyparallel` library.
-    """
-    parallel_factories = {
-        None: SerialFactory,
-        "multiprocessing": MultiprocessingFactory,
-    }
-    if dask_available:  # pragma: no cover
-        parallel_factories["dask"] = DaskFactory
-    if dask_df_available:  # pragma: no cover
-        parallel_factories["dask_dataframe"] = DaskDataFrameFactory
-    if ipyparallel_available:  # pragma: no cover
-        parallel_factories["ipyparallel"] = IPyParallelFactory
+    * mpi: return a mapper using MPI directly through the :mod:`mpi4py` library.
 
+    The libraries required by a factory are only imported when this factory is initialized.
+    """
     try:
-        parallel_factory = parallel_factories[parallel_lib](*args, **kwargs)
-    except KeyError:
+        factory_class, required_modules = _PARALLEL_FACTORIES[parallel_lib]
+
+        # The libraries are only imported when the factory is required
+        for module_name in required_modules:
+            importlib.import_module(module_name)
+    except (KeyError, ImportError) as exc:
         L.critical(
             "The %s factory is not available, maybe the required libraries are not properly "
             "installed.",
             parallel_lib,
         )
-        raise
+        raise KeyError(parallel_lib) from exc
+
+    parallel_factory = factory_class(*args, **kwargs)
     L.info("Initialized %s factory", parallel_lib)
     return parallel_factory
@@ -0,0 +1,214 @@
+"""Module used to generate the rows of parameter grids and samples on the fly."""
+
+# Copyright 2021-2024 Blue Brain Project / EPFL
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import warnings
+from abc import abstractmethod
+
+import numpy as np
+import pandas as pd
+
+
+class ParameterSpace:
+    """Abstract class of the parameter spaces whose rows are generated on the fly.
+
+    Each row of a parameter space has a deterministic integer ID between ``0`` and
+    ``len(space) - 1``, so a subset of the rows can be generated without generating the other
+    ones. A parameter space can be given to :func:`bluepyparallel.evaluate` instead of a
+    :class:`pandas.DataFrame`.
+    """
+
+    columns = []
+    deterministic = True
+
+    @abstractmethod
+    def __len__(self):
+        """Return the number of rows of the parameter space."""
+
+    @abstractmethod
+    def _values(self, ids):
+        """Return a dict containing the values of each column for the given row IDs."""
+
+    def rows(self, ids):
+        """Generate the rows with the given IDs.
+
+        Return:
+            pandas.DataFrame: the rows indexed by their IDs.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) > 0 and (ids.min() < 0 or ids.max() >= len(self)):
+            raise IndexError(f"The row IDs must be between 0 and {len(self) - 1}")
+        return pd.DataFrame(self._values(ids), index=ids, columns=self.columns)
+
+    def to_dataframe(self):
+        """Generate all the rows of the parameter space."""
+        return self.rows(np.arange(len(self)))
+
+
+def _axis_values(values):
+    """Convert the values of an axis into a 1-D array without coercing them.
+
+    The values are stored in an object array that is converted to the type inferred by pandas,
+    so the numbers of an axis are typed while the strings, the tuples or the mixed values are
+    kept as they are.
+    """
+    values = list(values)
+    axis = np.empty(len(values), dtype=object)
+    for num, value in enumerate(values):
+        axis[num] = value
+    return pd.Series(axis, dtype=object).infer_objects().to_numpy()
+
+
+class ParameterGrid(ParameterSpace):
+    """The Cartesian product of named parameter axes.
+
+    The rows are ordered like in :func:`itertools.product`, so the values of the last axis
+    change first.
+
+    Args:
+        axes (dict): the values of each parameter.
+    """
+
+    def __init__(self, axes):
+        if not axes:
+            raise ValueError("At least one axis must be given")
+        self.axes = {name: _axis_values(values) for name, values in axes.items()}
+        self.columns = list(self.axes.keys())
+        self.shape = tuple(len(values) for values in self.axes.values())
+
+    def __len__(self):
+        """Return the number of rows of the grid."""
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def _values(self, ids):
+        indices = np.unravel_index(ids, self.shape)
+        return {
+            name: values[axis_indices]
+            for (name, values), axis_indices in zip(self.axes.items(), indices)
+        }
+
+
+class _Sampler(ParameterSpace):
+    """Base class of the samplers of a hypercube.
+
+    Args:
+        bounds (dict): the lower and upper bounds of each parameter.
+        n_samples (int): the number of samples.
+        seed (int): the seed of the random generator, which must be given to resume a
+            computation (otherwise the samples are different each time they are generated).
+    """
+
+    def __init__(self, bounds, n_samples, seed=None):
+        if not bounds:
+            raise ValueError("At least one parameter must be given")
+        self.columns = list(bounds.keys())
+        self.lower_bounds = np.array([bound[0] for bound in bounds.values()], dtype=float)
+        self.upper_bounds = np.array([bound[1] for bound in bounds.values()], dtype=float)
+        self.n_samples = int(n_samples)
+        self.seed = seed
+        self.deterministic = seed is not None
+
+    def __len__(self):
+        """Return the number of samples."""
+        return self.n_samples
+
+    @abstractmethod
+    def _unit_sample(self, ids):
+        """Return the samples of the unit hypercube with the given IDs."""
+
+    def _values(self, ids):
+        sample = self.lower_bounds + self._unit_sample(ids) * (
+            self.upper_bounds - self.lower_bounds
+        )
+        return {name: sample[:, num] for num, name in enumerate(self.columns)}
+
+
+class SobolSampler(_Sampler):
+    """A scrambled Sobol sequence in the hypercube given by the bounds of each parameter.
+
+    The sequence is generated with :class:`scipy.stats.qmc.Sobol`, and the samples of a range of
+    IDs are generated by skipping the previous points of the sequence. Note that the balance
+    properties of the sequence require the number of samples to be a power of 2.
+
+    Args:
+        bounds (dict): the lower and upper bounds of each parameter.
+        n_samples (int): the number of samples.
+        seed (int): the seed used to scramble the sequence, which must be given to resume a
+            computation. If not given, a seed is drawn once so all the rows of the object come
+            from the same sequence.
+        scramble (bool): if set to False, the sequence is not scrambled and is thus always the
+            same.
+    """
+
+    def __init__(self, bounds, n_samples, seed=None, scramble=True):
+        super().__init__(bounds, n_samples, seed)
+        self.scramble = scramble
+        self.deterministic = seed is not None or not scramble
+        if seed is None and scramble:
+            self._scramble_seed = int(np.random.SeedSequence().entropy)
+        else:
+            self._scramble_seed = seed
+
+        # Check that scipy is available
+        from scipy.stats import qmc  # noqa ; pylint: disable=import-outside-toplevel,unused-import
+
+        if self.n_samples & (self.n_samples - 1) != 0:
+            warnings.warn("The balance properties of Sobol' points require n to be a power of 2.")
+
+    def _unit_sample(self, ids):
+        from scipy.stats import qmc  # pylint: disable=import-outside-toplevel
+
+        if len(ids) == 0:
+            return np.empty((0, len(self.columns)))
+        start = int(ids.min())
+        sampler = qmc.Sobol(d=len(self.columns), scramble=self.scramble, seed=self._scramble_seed)
+        if start > 0:
+            sampler.fast_forward(start)
+        with warnings.catch_warnings():
+            # The balance properties are checked in the constructor
+            warnings.simplefilter("ignore", UserWarning)
+            sample = sampler.random(int(ids.max()) + 1 - start)
+        return sample[ids - start]
+
+
+class LatinHypercubeSampler(_Sampler):
+    """A Latin hypercube sample in the hypercube given by the bounds of each parameter.
+
+    The samples of a Latin hypercube depend on each other, so the sample of the unit hypercube
+    is generated at once the first time some rows are generated. It thus requires 8 bytes per
+    value, which is much less than a :class:`pandas.DataFrame` of the same size.
+
+    Args:
+        bounds (dict): the lower and upper bounds of each parameter.
+        n_samples (int): the number of samples.
+        seed (int): the seed of the random generator, which must be given to resume a
+            computation.
+    """
+
+    def __init__(self, bounds, n_samples, seed=None):
+        super().__init__(bounds, n_samples, seed)
+        self._sample = None
+
+    def _unit_sample(self, ids):
+        if self._sample is None:
+            rng = np.random.default_rng(self.seed)
+            nb_params = len(self.columns)
+            permutations = np.stack(
+                [rng.permutation(self.n_samples) for _ in range(nb_params)], axis=1
+            )
+            self._sample = (permutations + rng.random((self.n_samples, nb_params))) / (
+                self.n_samples
+            )
+        return self._sample[ids]
@@ -0,0 +1,282 @@
+"""Module to evaluate several functions chained on the rows of a dataframe."""
+
+# Copyright 2021-2024 Blue Brain Project / EPFL
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from bluepyparallel.checkpoint import CheckpointLog
+from bluepyparallel.evaluator import _add_new_columns
+from bluepyparallel.evaluator import _try_evaluation
+from bluepyparallel.parallel import DaskDataFrameFactory
+from bluepyparallel.parallel import init_parallel_factory
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """A stage of a pipeline.
+
+    Args:
+        name (str): the name of the stage, which is used to name its exception column
+            ``<name>_exception``.
+        evaluation_function (callable): the function used to evaluate each row. It receives the
+            values of the input columns and of the new columns of the previous stages.
+        new_columns (list): the names and empty values of the new columns of the stage, like in
+            :func:`bluepyparallel.evaluator.evaluate`.
+        func_args (list): the arguments to pass to the evaluation_function.
+        func_kwargs (dict): the keyword arguments to pass to the evaluation_function.
+        checkpoint_path (str): the path to the checkpoint log of the stage (see
+            :class:`bluepyparallel.checkpoint.CheckpointLog`).
+    """
+
+    def __init__(
+        self,
+        name,
+        evaluation_function,
+        new_columns=None,
+        func_args=None,
+        func_kwargs=None,
+        checkpoint_path=None,
+    ):  # pylint: disable=too-many-arguments
+        self.name = name
+        self.evaluation_function = evaluation_function
+        self.new_columns = list(new_columns) if new_columns is not None else []
+        self.func_args = func_args if func_args is not None else []
+        self.func_kwargs = func_kwargs if func_kwargs is not None else {}
+        self.checkpoint_path = checkpoint_path
+
+    @property
+    def exception_column(self):
+        """The name of the exception column of the stage."""
+        return f"{self.name}_exception"
+
+    @property
+    def columns(self):
+        """The names of the new columns of the stage, without the exception column."""
+        return [col[0] for col in self.new_columns]
+
+
+def _evaluate_stages(task, stages):
+    """Evaluate the stages of a row one after the other, starting from the given stage.
+
+    The results of a stage are added to the row given to the next stages, and the next stages are
+    not evaluated when an exception is raised.
+
+    The task is a flat ``(task_id, row, first_stage)`` record, so it can be split into batches by
+    the parallel factories like the ``(task_id, row)`` records of
+    :func:`bluepyparallel.evaluator.evaluate`.
+    """
+    task_id, row, first_stage = task
+    results = []
+    for stage in stages[first_stage:]:
+        _, result, exception = _try_evaluation(
+            (task_id, row), stage.evaluation_function, stage.func_args, stage.func_kwargs
+        )
+        results.append((result, exception))
+        if exception is not None:
+            break
+        row = dict(row, **result)
+    return task_id, first_stage, results
+
+
+def _check_stages(stages, input_cols):
+    """Check that the names of the stages and of their columns are unique."""
+    if not stages:
+        raise ValueError("At least one stage must be given")
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("The names of the stages must be unique")
+    columns = list(input_cols)
+    for stage in stages:
+        columns.extend([stage.exception_column] + stage.columns)
+    if len(set(columns)) != len(columns):
+        raise ValueError("The new columns of the stages must be unique and not be input columns")
+
+
+def _set_stage_results(to_evaluate, stage, res_df):
+    """Set the results of a stage into the output DataFrame.
+
+    The rows for which the stage raised an exception only get this exception, so the new columns
+    of the stage keep their empty values.
+    """
+    failed = res_df[stage.exception_column].notnull()
+    to_evaluate.loc[res_df.index[failed], stage.exception_column] = res_df.loc[
+        failed, stage.exception_column
+    ]
+    res_df = res_df.loc[~failed]
+    to_evaluate.loc[res_df.index, res_df.columns] = res_df
+
+
+def _gather_stage_results(to_evaluate, stages, res):
+    """Gather the results of the stages into the output DataFrame."""
+    for stage, stage_res in zip(stages, res):
+        if not stage_res:
+            continue
+        res_df = (
+            pd.DataFrame(stage_res)
+            .set_index("df_index")
+            .rename(columns={"exception": stage.exception_column})
+        )
+        _set_stage_results(to_evaluate, stage, res_df)
+
+
+def _prepare_stage_checkpoints(stages, to_evaluate, resume):
+    """Prepare the checkpoint logs of the stages and load their results when resuming.
+
+    Return:
+        tuple: the checkpoint logs (or None for the stages without checkpoint) and the index of
+        the first stage to evaluate for each row (the number of stages if the row is done).
+    """
+    checkpoints = []
+    first_stages = np.zeros(len(to_evaluate), dtype=int)
+    # The rows whose previous stages are all done and valid
+    pending = np.ones(len(to_evaluate), dtype=bool)
+    for num, stage in enumerate(stages):
+        if stage.checkpoint_path is None:
+            checkpoints.append(None)
+            pending[:] = False
+            continue
+
+        checkpoint = CheckpointLog(stage.checkpoint_path)
+        checkpoints.append(checkpoint)
+        if not resume or not checkpoint.exists():
+            logger.info("Create the checkpoint log of the stage '%s'", stage.name)
+            checkpoint.create()
+            pending[:] = False
+            continue
+
+        logger.info("Load data from the checkpoint log of the stage '%s'", stage.name)
+        previous_results = checkpoint.load()
+        if previous_results.empty:
+            pending[:] = False
+            continue
+
+        # The rows evaluated again after an interruption are recorded several times
+        previous_results = previous_results.loc[
+            ~previous_results.index.duplicated(keep="last")
+            & previous_results.index.isin(to_evaluate.index)
+        ].rename(columns={"exception": stage.exception_column})
+        _set_stage_results(to_evaluate, stage, previous_results)
+
+        done = to_evaluate.index.isin(previous_results.index)
+        failed = to_evaluate.index.isin(
+            previous_results.index[previous_results[stage.exception_column].notnull()]
+        )
+        first_stages[pending & done] = num + 1
+        first_stages[pending & failed] = len(stages)
+        pending &= done & ~failed
+
+    return checkpoints, first_stages
+
+
+def evaluate_pipeline(
+    df,
+    stages,
+    resume=False,
+    parallel_factory=None,
+    shuffle_rows=True,
+    progress_bar=True,
+    **mapper_kwargs,
+):
+    """Evaluate a pipeline of stages on the rows of a dataframe.
+
+    All the stages of a row are evaluated one after the other in the same task, so the results
+    of a stage are given to the next stage as soon as they are computed. The stages thus share
+    the same parallel factory, no stage has to wait for the last rows of the previous stage and
+    the intermediate results are not gathered into intermediate dataframes. When a stage raises
+    an exception for a row, the next stages are not evaluated for this row and keep their empty
+    values.
+
+    The results of each stage are written into its own checkpoint log. When resuming, each row
+    starts from the first stage that is not in the checkpoint logs.
+
+    Args:
+        df (pandas.DataFrame): each row contains information for the computation.
+        stages (list): the :class:`Stage` objects, in the order they are evaluated.
+        resume (bool): if :obj:`True`, the stages that are already in the checkpoint logs are
+            not computed again.
+        parallel_factory (ParallelFactory or str): parallel factory name or instance. The
+            :class:`bluepyparallel.parallel.DaskDataFrameFactory` is not supported.
+        shuffle_rows (bool): if :obj:`True`, it will shuffle the rows before computing the results.
+        progress_bar (bool): if :obj:`True`, a progress bar will be displayed during computation.
+        **mapper_kwargs: the keyword arguments are passed to the get_mapper() method of the
+            :class:`ParallelFactory` instance.
+
+    Return:
+        pandas.DataFrame: dataframe with the exception column and the new columns of each stage.
+    """
+    # Initialize the parallel factory
+    if isinstance(parallel_factory, str) or parallel_factory is None:
+        parallel_factory = init_parallel_factory(parallel_factory)
+    if isinstance(parallel_factory, DaskDataFrameFactory):
+        raise ValueError("The pipelines can not be used with 'DaskDataFrameFactory'")
+
+    stages = list(stages)
+    input_cols = df.columns.tolist()
+    _check_stages(stages, input_cols)
+
+    # Shallow copy the given DataFrame to add the new columns
+    to_evaluate = df.copy()
+    if shuffle_rows:
+        to_evaluate = to_evaluate.sample(frac=1)
+    for stage in stages:
+        to_evaluate = _add_new_columns(to_evaluate, [[stage.exception_column, None]])
+        to_evaluate = _add_new_columns(to_evaluate, stage.new_columns)
+
+    checkpoints, first_stages = _prepare_stage_checkpoints(stages, to_evaluate, resume)
+
+    # Split the data into rows containing the results of the stages that are already done
+    arg_list = []
+    for first_stage in range(len(stages)):
+        cols = input_cols + [col for stage in stages[:first_stage] for col in stage.columns]
+        rows = to_evaluate.loc[first_stages == first_stage, cols].to_dict("index")
+        arg_list.extend((task_id, row, first_stage) for task_id, row in rows.items())
+
+    if arg_list:
+        logger.info("%s rows to compute.", len(arg_list))
+    else:
+        logger.warning("WARNING: No row to compute, something may be wrong")
+
+    res = [[] for _ in stages]
+    mapper = parallel_factory.get_mapper(**mapper_kwargs)
+    try:
+        tasks = mapper(partial(_evaluate_stages, stages=stages), arg_list)
+        if progress_bar:
+            tasks = tqdm(tasks, total=len(arg_list))
+        # Compute and collect the results of each stage
+        for task_id, first_stage, results in tasks:
+            for num, (result, exception) in enumerate(results, first_stage):
+                res[num].append(dict({"df_index": task_id, "exception": exception}, **result))
+                if checkpoints[num] is not None:
+                    checkpoints[num].append(task_id, dict(result, exception=exception))
+    except (KeyboardInterrupt, SystemExit) as ex:  # pragma: no cover
+        # To save dataframe even if program is killed
+        logger.warning("Stopping mapper loop. Reason: %r", ex)
+    finally:
+        for checkpoint in checkpoints:
+            if checkpoint is not None:
+                checkpoint.close()
+
+    _gather_stage_results(to_evaluate, stages, res)
+
+    if shuffle_rows:
+        return to_evaluate.loc[df.index]
+
+    return to_evaluate
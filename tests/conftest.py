@@ -30,7 +30,7 @@ def db_url(tmpdir):
     return tmpdir / "db.sql"
 
 
-@pytest.fixture(params=[None, "multiprocessing", "ipyparallel", "dask", "dask_dataframe"])
+@pytest.fixture(params=[None, "multiprocessing", "ipyparallel", "dask", "dask_dataframe", "mpi"])
 def factory_type(request):
     """The factory type."""
     return request.param
@@ -51,6 +51,7 @@ def dask_cluster():
         {"batch_size": 2},
         {"chunk_size": 2, "batch_size": 2},
         {"chunk_size": 999, "batch_size": 999},
+        {"batch_size": 2, "max_pending_batches": 2},
     ]
 )
 def parallel_factory(factory_type, dask_cluster, request):
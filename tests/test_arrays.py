@@ -0,0 +1,89 @@
+"""Test the ``bluepyparallel.arrays`` module."""
+
+# Copyright 2021-2024 Blue Brain Project / EPFL
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-function-docstring
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from bluepyparallel import arrays
+
+CODECS = ["none", "zlib"]
+if arrays.zstandard_available:
+    CODECS.append("zstd")
+if arrays.lz4_available:
+    CODECS.append("lz4")
+
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize(
+    "array",
+    [
+        np.linspace(0, 1, 100),
+        np.arange(12, dtype=np.int32).reshape(3, 4),
+        np.arange(12, dtype=">i8").reshape(3, 4).T,
+        np.array([True, False]),
+        np.array(["a", "bc"]),
+        np.array(5.0),
+        np.zeros((0, 3)),
+    ],
+)
+def test_encode_decode(array, codec):
+    """Test that the arrays are the same after encoding and decoding."""
+    blob = arrays.encode_array(array, codec)
+    res = arrays.decode_array(blob)
+    assert res.dtype == array.dtype
+    assert_array_equal(res, array)
+
+
+def test_decode_zero_copy():
+    """Test that the uncompressed arrays are views of the blob."""
+    array = np.linspace(0, 1, 100)
+    blob = arrays.encode_array(array, "none")
+    res = arrays.decode_array(blob)
+    assert not res.flags.owndata
+    assert not res.flags.writeable
+
+
+def test_errors():
+    """Test the errors when encoding and decoding arrays."""
+    with pytest.raises(ValueError, match="Only the arrays of numbers, booleans or strings can be"):
+        arrays.encode_array(np.array([{}, []], dtype=object))
+
+    with pytest.raises(ValueError, match="The codec must be one of"):
+        arrays.encode_array(np.zeros(3), "unknown")
+
+    with pytest.raises(ValueError, match="The blob does not contain an encoded array"):
+        arrays.decode_array(b"not an array")
+
+
+def test_lazy_array():
+    """Test the ``LazyArray`` class."""
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    lazy_array = arrays.LazyArray(arrays.encode_array(array))
+
+    assert lazy_array.shape == (3, 4)
+    assert lazy_array.dtype == np.float32
+    assert len(lazy_array) == 3
+    assert repr(lazy_array) == "LazyArray(shape=(3, 4), dtype=float32)"
+
+    assert_array_equal(np.asarray(lazy_array), array)
+    assert lazy_array.load() is lazy_array.load()
+    assert np.asarray(lazy_array, dtype=np.float64).dtype == np.float64
+
+    # The 0-d arrays have no length, like the NumPy arrays
+    with pytest.raises(TypeError, match=r"len\(\) of unsized object"):
+        len(arrays.LazyArray(arrays.encode_array(np.array(5.0))))
@@ -0,0 +1,86 @@
+"""Test the ``bluepyparallel.checkpoint`` module."""
+
+# Copyright 2021-2024 Blue Brain Project / EPFL
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+import pandas as pd
+import pytest
+from pandas._testing import assert_frame_equal
+
+from bluepyparallel.checkpoint import CheckpointLog
+
+
+@pytest.fixture
+def checkpoint_path(tmpdir):
+    """The path to the checkpoint log."""
+    return tmpdir / "checkpoint.log"
+
+
+@pytest.fixture
+def expected_df():
+    """The values written in the checkpoint log."""
+    return pd.DataFrame(
+        {"result": [float(i) for i in range(5)], "exception": [None] * 5},
+        index=[f"idx_{i}" for i in range(5)],
+    )
+
+
+def _write(checkpoint, df):
+    for task_id, values in df.to_dict("index").items():
+        checkpoint.append(task_id, values)
+
+
+class TestCheckpointLog:
+    """Test the ``CheckpointLog`` class."""
+
+    @pytest.mark.parametrize("fsync", [True, False])
+    def test_write_load(self, checkpoint_path, expected_df, fsync):
+        """Test that the records written by batches are loaded."""
+        checkpoint = CheckpointLog(checkpoint_path, batch_size=2, fsync=fsync)
+        assert not checkpoint.exists()
+        checkpoint.create()
+        _write(checkpoint, expected_df)
+        checkpoint.close()
+
+        assert checkpoint.exists()
+        assert_frame_equal(CheckpointLog(checkpoint_path).load(), expected_df)
+
+    def test_load_empty(self, checkpoint_path):
+        """Test loading an empty log."""
+        checkpoint = CheckpointLog(checkpoint_path)
+        checkpoint.create()
+        checkpoint.close()
+
+        assert CheckpointLog(checkpoint_path).load().empty
+
+    @pytest.mark.parametrize("nb_removed_bytes", [1, 10])
+    def test_truncated_tail(self, checkpoint_path, expected_df, nb_removed_bytes):
+        """Test that a truncated frame is ignored and removed before new records are appended."""
+        checkpoint = CheckpointLog(checkpoint_path, batch_size=3)
+        checkpoint.create()
+        _write(checkpoint, expected_df)
+        checkpoint.close()
+
+        # Simulate a crash while the last frame was written
+        with open(checkpoint_path, "r+b") as file:
+            file.truncate(checkpoint_path.size() - nb_removed_bytes)
+
+        checkpoint = CheckpointLog(checkpoint_path)
+        assert_frame_equal(checkpoint.load(), expected_df.iloc[:3])
+
+        _write(checkpoint, expected_df.iloc[3:])
+        checkpoint.close()
+        assert_frame_equal(CheckpointLog(checkpoint_path).load(), expected_df)
@@ -16,16 +16,28 @@
 
 # pylint: disable=missing-function-docstring
 # pylint: disable=redefined-outer-name
+import multiprocessing
+import os
 import time
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 
 import numpy as np
 import pandas as pd
 import pytest
+from numpy.testing import assert_array_equal
 from pandas._testing import assert_frame_equal
 
 from bluepyparallel import evaluate
 from bluepyparallel import init_parallel_factory
+from bluepyparallel.database import BatchWriter
+from bluepyparallel.database import DataBase
+from bluepyparallel.database import ShardedDataBase
+from bluepyparallel.evaluator import _new_columns_meta
+from bluepyparallel.evaluator import _try_evaluation_partition
+from bluepyparallel.parameter_space import LatinHypercubeSampler
+from bluepyparallel.parameter_space import ParameterGrid
 
 
 def _evaluation_function(row, factor=10.0, coeff=0.0):
@@ -57,6 +69,54 @@ def _slow_function(row, *args, **kwargs):
     return _evaluation_function(row, *args, **kwargs)
 
 
+def _array_function(row):
+    """Mock evaluation function returning an array."""
+    return {"trace": np.linspace(0, row["value"], int(row["value_1"]))}
+
+
+def _load_context(row):
+    """Mock context function."""
+    if row["value"] == 3:
+        raise ValueError("The context can not be loaded")
+    return {"double": 2 * row["value"]}
+
+
+def _first_function(row, context, coeff=0.0):  # pylint: disable=unused-argument
+    """Mock evaluation function using a context."""
+    return {"result_orig": context["double"] / 2 + coeff}
+
+
+def _second_function(row, context, coeff=0.0):  # pylint: disable=unused-argument
+    """Mock evaluation function using a context."""
+    if row["value"] == 2:
+        raise ValueError("The value should not be 2")
+    return {"result_10": 10 * row["value_1"] + coeff}
+
+
+def _typed_function(row):
+    """Mock evaluation function whose results do not match the types of the new columns."""
+    if row["value"] == 3:
+        raise ValueError("The value should not be 3")
+    return {"int_col": row["value"] + 0.7, "str_col": "no", "float_col": int(row["value"])}
+
+
+def _memory_estimate(row):
+    """Mock memory estimate function."""
+    return row["value_1"]
+
+
+def _evaluate_cooperative(df, db_url):
+    """Evaluate the given DF in cooperative mode."""
+    return evaluate(
+        df,
+        _slow_function,
+        [["result_orig", 0.0], ["result_10", 0.0]],
+        db_url=db_url,
+        cooperative=True,
+        claim_size=2,
+    )
+
+
 def remove_sql_cols(df):
     """Remove columns that start with 'to_run_' from a DF."""
     df.drop(
@@ -209,6 +269,51 @@ class TestEvaluate:
         )
         assert "The value should not be 1" in result_df.loc[0, "exception"]
 
+    @pytest.mark.parametrize("with_sql", [True, False])
+    def test_evaluate_dask_bundles(
+        self, input_df, new_columns, expected_df, db_url, with_sql, dask_cluster
+    ):
+        """Test evaluator with a dask factory that bundles the tasks."""
+        parallel_factory = init_parallel_factory("dask", address=dask_cluster, bundle_size=2)
+        result_df = evaluate(
+            input_df,
+            _failing_function,
+            new_columns,
+            db_url=db_url if with_sql else None,
+            parallel_factory=parallel_factory,
+        )
+        remove_sql_cols(expected_df)
+
+        assert_frame_equal(result_df.loc[[1, 2]], expected_df.loc[[1, 2]], check_like=True)
+        assert "The value should not be 1" in result_df.loc[0, "exception"]
+
+    def test_evaluate_dask_dataframe_partitions(
+        self, input_df, new_columns, expected_df, db_url, dask_cluster, monkeypatch
+    ):
+        """Test that the results of each partition are written to the DB when they are ready."""
+        parallel_factory = init_parallel_factory("dask_dataframe", address=dask_cluster)
+
+        written_batches = []
+        write_batch = BatchWriter.write_batch
+
+        def _write_batch(self, columns, data):
+            written_batches.append(len(data))
+            return write_batch(self, columns, data)
+
+        monkeypatch.setattr(BatchWriter, "write_batch", _write_batch)
+
+        result_df = evaluate(
+            input_df,
+            _evaluation_function,
+            new_columns,
+            parallel_factory=parallel_factory,
+            db_url=db_url,
+            chunk_size=1,
+        )
+
+        assert_frame_equal(result_df, expected_df, check_like=True)
+        assert written_batches == [1, 1, 1]
+
     def test_evaluate_keyboard_interrupt(self, input_df, expected_df):
         """Test evaluator with a ``KeyboardInterrupt``.
 
@@ -384,6 +489,443 @@ class TestEvaluate:
         )
         assert_frame_equal(result_df, expected_df, check_like=True)
 
+    def test_evaluate_cooperative(self, input_df, new_columns, expected_df, db_url):
+        """Test that several processes share the rows through the task queue of the DB."""
+        input_df = input_df.loc[np.repeat(input_df.index.values, 5)].reset_index(drop=True)
+        expected_df = expected_df.loc[np.repeat(expected_df.index.values, 5)].reset_index(drop=True)
+
+        with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [
+                executor.submit(_evaluate_cooperative, input_df, str(db_url)) for _ in range(2)
+            ]
+            for future in futures:
+                future.result()
+
+        # Each row was evaluated once
+        db = DataBase(db_url)
+        db.reflect("df")
+        db_df = db.load()
+        assert db_df.index.is_unique
+        assert_frame_equal(db_df.sort_index(), expected_df, check_like=True, check_names=False)
+
+        # Resuming in cooperative mode does not compute anything
+        result_df = evaluate(
+            input_df, _failing_function, new_columns, db_url=db_url, cooperative=True
+        )
+        assert_frame_equal(result_df, expected_df, check_like=True)
+
+    def test_evaluate_cooperative_in_process(
+        self, input_df, new_columns, expected_df, tmpdir, monkeypatch
+    ):
+        """Test the cooperative mode in the current process."""
+        claim_tasks = DataBase.claim_tasks
+        claims = []
+
+        def _claim_tasks(self, nb_tasks, lease_duration):
+            if not claims:
+                # The first tasks are claimed by another process at the same time
+                claims.append([])
+                return []
+            claims.append(claim_tasks(self, nb_tasks, lease_duration))
+            return claims[-1]
+
+        monkeypatch.setattr(DataBase, "claim_tasks", _claim_tasks)
+        result_df = evaluate(
+            input_df,
+            _evaluation_function,
+            new_columns,
+            db_url=tmpdir / "db.sql",
+            cooperative=True,
+            claim_size=2,
+        )
+        assert_frame_equal(result_df.sort_index(), expected_df, check_like=True)
+        assert [len(claim) for claim in claims] == [0, 2, 1, 0]
+
+        # The claim loop stops when the computation is interrupted
+        result_df = evaluate(
+            input_df,
+            _interrupting_function,
+            new_columns,
+            db_url=tmpdir / "interrupted_db.sql",
+            cooperative=True,
+            claim_size=3,
+        )
+        assert len(result_df) < 3
+
+    @pytest.mark.parametrize("from_column", [True, False])
+    def test_evaluate_memory_estimate(self, input_df, new_columns, expected_df, from_column):
+        """Test evaluator with memory estimates."""
+        parallel_factory = init_parallel_factory("multiprocessing", processes=2, memory_budget=3)
+        if from_column:
+            memory_estimate = "value"
+        else:
+            memory_estimate = _memory_estimate
+        result_df = evaluate(
+            input_df,
+            _evaluation_function,
+            new_columns,
+            parallel_factory=parallel_factory,
+            memory_estimate=memory_estimate,
+        )
+        assert_frame_equal(result_df, expected_df, check_like=True)
+
+        with pytest.raises(
+            ValueError,
+            match=r"The memory estimates can only be used with 'MultiprocessingFactory' or",
+        ):
+            evaluate(input_df, _evaluation_function, new_columns, memory_estimate="value")
+
+    def test_evaluate_checkpoint(
+        self, input_df, new_columns, expected_df, tmpdir, parallel_factory
+    ):
+        """Test evaluator with a checkpoint log."""
+        checkpoint_path = tmpdir / "checkpoint.log"
+
+        # Compute some values
+        tmp_df = evaluate(
+            input_df.loc[[0, 2]],
+            _evaluation_function,
+            new_columns,
+            parallel_factory=parallel_factory,
+            checkpoint_path=checkpoint_path,
+        )
+
+        # Compute only the missing values
+        result_df = evaluate(
+            input_df,
+            _failing_function,
+            new_columns,
+            resume=True,
+            parallel_factory=parallel_factory,
+            checkpoint_path=checkpoint_path,
+        )
+
+        # The values of the first computation are not computed again
+        assert_frame_equal(result_df.loc[[0, 2]], tmp_df, check_like=True)
+        assert_frame_equal(result_df.loc[[1]], expected_df.loc[[1]], check_like=True)
+
+        with pytest.raises(
+            ValueError, match=r"The 'db_url' and 'checkpoint_path' arguments can not be used"
+        ):
+            evaluate(
+                input_df,
+                _evaluation_function,
+                new_columns,
+                db_url=tmpdir / "db.sql",
+                checkpoint_path=checkpoint_path,
+            )
+
+    def test_evaluate_shards(self, input_df, new_columns, expected_df, db_url, parallel_factory):
+        """Test evaluator with results written into one shard per process."""
+        # Compute some values
+        tmp_df = evaluate(
+            input_df.loc[[1]],
+            _evaluation_function,
+            new_columns,
+            parallel_factory=parallel_factory,
+            db_url=db_url,
+            db_shards=True,
+        )
+
+        # The shards are merged at the end of the computation
+        sharded_db = ShardedDataBase(db_url)
+        assert not os.path.exists(sharded_db.shard_dir)
+        sharded_db.reflect(expected_df)
+
+        # Write a result into a shard that was not merged, as if the process was killed
+        shard_writer = sharded_db.shard_writer()
+        shard_writer.write_batch(
+            expected_df.columns.tolist(), expected_df.loc[[2]].to_records().tolist()
+        )
+        assert len(sharded_db.shard_paths()) == 1
+
+        # Compute only the missing values
+        result_df = evaluate(
+            input_df,
+            _failing_function,
+            new_columns,
+            resume=True,
+            parallel_factory=parallel_factory,
+            db_url=db_url,
+            db_shards=True,
+        )
+
+        # The values of the DB and of the shard are not computed again
+        assert_frame_equal(result_df.loc[[1]], tmp_df, check_like=True)
+        assert_frame_equal(result_df.loc[[2]], expected_df.loc[[2]], check_like=True)
+        assert "The value should not be 1" in result_df.loc[0, "exception"]
+
+        # All the results are merged into the DB
+        assert sharded_db.shard_paths() == []
+        db = DataBase(db_url)
+        db.reflect("df")
+        res = db.load()
+        assert sorted(res.index) == [0, 1, 2]
+        assert_frame_equal(
+            res.loc[[1, 2]], result_df.loc[[1, 2]], check_like=True, check_names=False
+        )
+
+        with pytest.raises(ValueError, match=r"The 'db_shards' argument can not be used in"):
+            evaluate(
+                input_df,
+                _evaluation_function,
+                new_columns,
+                db_url=db_url,
+                db_shards=True,
+                cooperative=True,
+            )
+
+    @pytest.mark.parametrize("db_upsert", [True, False])
+    def test_evaluate_db_writer(self, input_df, new_columns, expected_df, db_url, db_upsert):
+        """Test evaluator with several writes in each transaction of the DB."""
+        result_df = evaluate(
+            input_df,
+            _evaluation_function,
+            new_columns,
+            db_url=db_url,
+            db_commit_interval=2,
+            db_upsert=db_upsert,
+        )
+        assert_frame_equal(result_df, expected_df, check_like=True)
+
+        db = DataBase(db_url)
+        db.reflect("df")
+        assert_frame_equal(db.load().sort_index(), expected_df, check_like=True, check_names=False)
+
+    def test_evaluate_arrays(self, input_df, db_url, parallel_factory):
+        """Test evaluator with a function returning arrays."""
+        new_columns = [["trace", np.array([])]]
+
+        # Compute some values
+        evaluate(
+            input_df.loc[[0, 2]],
+            _array_function,
+            new_columns,
+            parallel_factory=parallel_factory,
+            db_url=db_url,
+        )
+
+        # Compute only the missing values
+        result_df = evaluate(
+            input_df,
+            _array_function,
+            new_columns,
+            resume=True,
+            parallel_factory=parallel_factory,
+            db_url=db_url,
+        )
+        for idx, row in input_df.iterrows():
+            expected = _array_function(row)["trace"]
+            assert_array_equal(np.asarray(result_df.loc[idx, "trace"]), expected)
+
+        # The arrays are stored as blobs in the DB
+        db = DataBase(db_url)
+        db.reflect("df")
+        assert db.array_columns == ["trace"]
+        res = db.load(lazy_arrays=False)
+        for idx, row in input_df.iterrows():
+            assert_array_equal(res.loc[idx, "trace"], _array_function(row)["trace"])
+
+    def test_evaluate_dedup(
+        self, input_df, new_columns, expected_df, db_url, parallel_factory, caplog
+    ):
+        """Test evaluator with duplicated input rows."""
+        input_df = pd.concat([input_df, input_df.loc[[0, 2, 2]]], ignore_index=True)
+        expected_df = pd.concat([expected_df, expected_df.loc[[0, 2, 2]]], ignore_index=True)
+
+        with caplog.at_level("INFO", logger="bluepyparallel.evaluator"):
+            result_df = evaluate(
+                input_df,
+                _evaluation_function,
+                new_columns,
+                parallel_factory=parallel_factory,
+                db_url=db_url,
+                dedup=True,
+            )
+        assert "3 duplicated rows will not be evaluated" in caplog.text
+        assert_frame_equal(result_df, expected_df, check_like=True)
+
+        # The results of the duplicated rows are also written into the DB
+        db = DataBase(db_url)
+        db.reflect("df")
+        assert_frame_equal(db.load().sort_index(), expected_df, check_like=True, check_names=False)
+
+        input_df["value"] = [[i] for i in range(len(input_df))]
+        with pytest.raises(ValueError, match=r"The 'dedup' argument can only be used with"):
+            evaluate(input_df, _evaluation_function, new_columns, dedup=True)
+
+        with pytest.raises(ValueError, match=r"The 'dedup' argument can not be used in"):
+            evaluate(
+                input_df,
+                _evaluation_function,
+                new_columns,
+                db_url=db_url,
+                dedup=True,
+                cooperative=True,
+            )
+
+    @pytest.mark.parametrize("with_sql", [True, False])
+    def test_evaluate_parameter_space(
+        self, new_columns, db_url, parallel_factory, with_sql, tmpdir
+    ):
+        """Test evaluator with the rows of a parameter space generated on the fly."""
+        grid = ParameterGrid({"value": [1.0, 2.0, 3.0], "value_1": [2.0, 3.0]})
+        expected_df = grid.to_dataframe()
+        expected_df["exception"] = None
+        expected_df["result_orig"] = expected_df["value"]
+        expected_df["result_10"] = 10 * expected_df["value_1"]
+        if with_sql:
+            sink_kwargs = {"db_url": db_url}
+        else:
+            sink_kwargs = {"checkpoint_path": tmpdir / "checkpoint.log"}
+
+        # Compute the rows until the computation is interrupted by the third row
+        tmp_df = evaluate(grid, _interrupting_function, new_columns, **sink_kwargs)
+        assert_frame_equal(tmp_df, expected_df.loc[[0, 1]], check_like=True, check_names=False)
+
+        # Compute only the missing rows
+        result_df = evaluate(
+            grid,
+            _evaluation_function,
+            new_columns,
+            resume=True,
+            parallel_factory=parallel_factory,
+            **sink_kwargs,
+        )
+        assert_frame_equal(
+            result_df.sort_index(), expected_df.loc[2:], check_like=True, check_names=False
+        )
+
+        if with_sql:
+            db = DataBase(db_url)
+            db.reflect("df")
+            assert_frame_equal(
+                db.load().sort_index(), expected_df, check_like=True, check_names=False
+            )
+
+        # The samples generated without seed can not be used to resume
+        with pytest.raises(ValueError, match="The parameter space must be deterministic to resume"):
+            evaluate(
+                LatinHypercubeSampler({"value": (0, 1), "value_1": (0, 1)}, 4),
+                _evaluation_function,
+                new_columns,
+                resume=True,
+                **sink_kwargs,
+            )
+
+        with pytest.raises(ValueError, match="The 'cooperative' and 'dedup' arguments can not be"):
+            evaluate(grid, _evaluation_function, new_columns, dedup=True)
+
+    @pytest.mark.parametrize("db_shards", [True, False])
+    def test_evaluate_parameter_space_db_resume(self, new_columns, db_url, db_shards):
+        """Test that the computation of a parameter space is resumed from the DB."""
+        grid = ParameterGrid({"value": [1.0, 2.0, 3.0], "value_1": [2.0, 3.0]})
+        expected_df = grid.to_dataframe()
+        expected_df["exception"] = None
+        expected_df["result_orig"] = expected_df["value"]
+        expected_df["result_10"] = 10 * expected_df["value_1"]
+
+        tmp_df = evaluate(
+            grid, _interrupting_function, new_columns, db_url=db_url, db_shards=db_shards
+        )
+        assert sorted(tmp_df.index) == [0, 1]
+
+        result_df = evaluate(
+            grid, _evaluation_function, new_columns, db_url=db_url, db_shards=db_shards, resume=True
+        )
+        assert sorted(result_df.index) == [2, 3, 4, 5]
+
+        db = DataBase(db_url)
+        db.reflect("df")
+        assert_frame_equal(db.load().sort_index(), expected_df, check_like=True, check_names=False)
+
+        # The columns of the DB must be the ones of the parameter space
+        with pytest.raises(ValueError, match="The columns of the DataBase are not consistent"):
+            evaluate(
+                ParameterGrid({"other": [1.0]}),
+                _evaluation_function,
+                new_columns,
+                db_url=db_url,
+                db_shards=db_shards,
+                resume=True,
+            )
+
+    def test_evaluate_parameter_space_single_mapper(self, new_columns, monkeypatch):
+        """Test that the rows of a parameter space are lazily given to a single mapper call."""
+        grid = ParameterGrid({"value": [1.0, 2.0, 3.0], "value_1": [2.0, 3.0]})
+        parallel_factory = init_parallel_factory(None, batch_size=2)
+        get_mapper = parallel_factory.get_mapper
+        iterables = []
+
+        def _get_mapper(**kwargs):
+            mapper = get_mapper(**kwargs)
+
+            def _mapper(func, iterable, **mapper_kwargs):
+                iterables.append(iterable)
+                return mapper(func, iterable, **mapper_kwargs)
+
+            return _mapper
+
+        monkeypatch.setattr(parallel_factory, "get_mapper", _get_mapper)
+        result_df = evaluate(
+            grid, _evaluation_function, new_columns, parallel_factory=parallel_factory
+        )
+        assert sorted(result_df.index) == list(range(6))
+        assert len(iterables) == 1
+        assert isinstance(iterables[0], Iterator)
+
+    def test_evaluate_several_functions(self, input_df, new_columns, db_url, parallel_factory):
+        """Test evaluator with several named functions and a context function."""
+        result_df = evaluate(
+            input_df,
+            {"first": _first_function, "second": _second_function},
+            new_columns,
+            parallel_factory=parallel_factory,
+            db_url=db_url,
+            func_kwargs={"coeff": 1.0},
+            context_function=_load_context,
+        )
+        assert result_df.columns.tolist() == [
+            "name",
+            "value",
+            "value_1",
+            "exception",
+            "first_exception",
+            "second_exception",
+            "result_orig",
+            "result_10",
+        ]
+        assert result_df.loc[[0, 1], "result_orig"].tolist() == [2.0, 3.0]
+        assert result_df.loc[0, "result_10"] == 21.0
+        assert result_df["first_exception"].isnull().all()
+
+        # The exception of a function does not prevent the other ones from being evaluated
+        assert result_df.loc[[0, 2], "second_exception"].isnull().all()
+        assert "The value should not be 2" in result_df.loc[1, "second_exception"]
+
+        # The exception of the context function prevents all the functions from being evaluated
+        assert result_df.loc[[0, 1], "exception"].isnull().all()
+        assert "The context can not be loaded" in result_df.loc[2, "exception"]
+
+        # The exception columns are written into the DB
+        db = DataBase(db_url)
+        db.reflect("df")
+        db_df = db.load().sort_index()
+        assert "The value should not be 2" in db_df.loc[1, "second_exception"]
+        assert "The context can not be loaded" in db_df.loc[2, "exception"]
+
+        with pytest.raises(
+            ValueError, match=r"The 'first_exception' column can not be one of the new columns"
+        ):
+            evaluate(input_df, {"first": _first_function}, [["first_exception", None]])
+
+    def test_evaluate_cooperative_no_db(self, input_df, new_columns):
+        """Test that the cooperative mode requires a DB."""
+        with pytest.raises(
+            ValueError, match=r"The 'db_url' argument must be provided in cooperative mode"
+        ):
+            evaluate(input_df, _evaluation_function, new_columns, cooperative=True)
+
 
 class TestBenchmark:
     """Some benchmark tests."""
@@ -423,3 +965,26 @@ class TestBenchmark:
         if not with_sql:
             remove_sql_cols(expected_df)
         assert_frame_equal(result_df, expected_df, check_like=True)
+
+
+class TestTryEvaluationPartition:
+    """Test the ``bluepyparallel.evaluator._try_evaluation_partition`` function."""
+
+    def test_types(self, input_df):
+        """Test that the results are only cast to the types of the new columns if lossless."""
+        meta = _new_columns_meta(
+            [["exception", None], ["int_col", 0], ["str_col", False], ["float_col", 0.0]]
+        )
+
+        res_df = _try_evaluation_partition(input_df.iloc[:2], _typed_function, [], {}, meta)
+        assert res_df["int_col"].tolist() == [1.7, 2.7]
+        assert res_df["str_col"].tolist() == ["no", "no"]
+        assert res_df["float_col"].dtype == np.float64
+        assert res_df["float_col"].tolist() == [1.0, 2.0]
+
+        # The failed rows keep their missing values
+        res_df = _try_evaluation_partition(input_df, _typed_function, [], {}, meta)
+        assert res_df["int_col"].tolist()[:2] == [1.7, 2.7]
+        assert res_df["str_col"].tolist() == ["no", "no", None]
+        assert res_df.loc[:, ["int_col", "float_col"]].iloc[2].isnull().all()
+        assert "The value should not be 3" in res_df.loc[2, "exception"]
@@ -0,0 +1,108 @@
+"""Test the import time of the ``bluepyparallel`` package."""
+
+# Copyright 2021-2024 Blue Brain Project / EPFL
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-function-docstring
+import subprocess
+import sys
+
+import pytest
+
+SLOW_MODULES = {"dask", "distributed", "dask_mpi", "ipyparallel", "mpi4py", "sqlalchemy"}
+
+
+def _import_times(code):
+    """Run the code in a new interpreter and return the cumulative import time of each module."""
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    import_times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+@pytest.mark.parametrize(
+    "code, lazy_modules",
+    [
+        ("import bluepyparallel", SLOW_MODULES | {"pandas", "bluepyparallel.evaluator"}),
+        (
+            "from bluepyparallel import init_parallel_factory\n"
+            "init_parallel_factory('multiprocessing', processes=1).shutdown()",
+            SLOW_MODULES | {"pandas"},
+        ),
+        (
+            "import pandas as pd\n"
+            "from bluepyparallel import evaluate\n"
+            "evaluate(pd.DataFrame({'a': [1, 2]}), lambda row: {'b': row['a']}, [['b', 0]])",
+            SLOW_MODULES,
+        ),
+    ],
+)
+def test_lazy_imports(code, lazy_modules):
+    """Test that the libraries are only imported when they are needed."""
+    import_times = _import_times(code)
+    assert "bluepyparallel" in import_times
+    imported = {name.split(".")[0] for name in import_times} | set(import_times)
+    assert not imported & lazy_modules
+
+
+def test_database_import(tmpdir):
+    """Test that the database module is imported when a database is used."""
+    import_times = _import_times(
+        "import pandas as pd\n"
+        "from bluepyparallel import evaluate\n"
+        "evaluate(pd.DataFrame({'a': [1, 2]}), lambda row: {'b': row['a']}, [['b', 0]], "
+        f"db_url={str(tmpdir / 'db.sql')!r})"
+    )
+    assert "bluepyparallel.database" in import_times
+    assert "sqlalchemy" in import_times
+    assert "dask" not in import_times
+
+
+def test_lazy_attributes():
+    """Test the attributes of the package that are imported lazily."""
+    import bluepyparallel  # pylint: disable=import-outside-toplevel
+
+    assert {"evaluate", "init_parallel_factory", "__version__"} <= set(dir(bluepyparallel))
+    assert callable(bluepyparallel.evaluate)
+    with pytest.raises(AttributeError, match="has no attribute 'unknown'"):
+        bluepyparallel.unknown  # pylint: disable=pointless-statement
+
+    # All the lazy attributes are public and can be imported with a star import
+    assert sorted(bluepyparallel.__all__) == sorted(
+        bluepyparallel._LAZY_ATTRIBUTES  # pylint: disable=protected-access
+    )
+    namespace = {}
+    exec("from bluepyparallel import *", namespace)  # pylint: disable=exec-used
+    assert set(bluepyparallel.__all__) <= set(namespace)
+
+
+class TestBenchmark:
+    """Some benchmark tests."""
+
+    def test_import_time(self, benchmark):
+        """Measure the time required to start an interpreter and import the package."""
+        benchmark(
+            subprocess.run,
+            [sys.executable, "-c", "import bluepyparallel"],
+            check=True,
+        )
@@ -16,20 +16,32 @@
 
 # pylint: disable=missing-function-docstring
 # pylint: disable=redefined-outer-name
+import glob
 import importlib.metadata
 import json
+import multiprocessing
+import os
+import shutil
 import subprocess
 import sys
+import time
+from collections import deque
 from collections.abc import Iterator
 from copy import deepcopy
+from types import SimpleNamespace
 
+import dask.distributed
+import numpy as np
 import pandas as pd
 import pytest
 import yaml
+from numpy.testing import assert_array_equal
 from packaging.version import Version
 
 from bluepyparallel import init_parallel_factory
+from bluepyparallel import parallel
 from bluepyparallel.parallel import DaskDataFrameFactory
+from bluepyparallel.parallel import _compute_core_sets
 
 dask_version = Version(importlib.metadata.version("dask"))
 
@@ -44,6 +56,35 @@ def _evaluation_function_dict(element, coeff_a=1.0, coeff_b=1.0):
     return element["a"] * coeff_a + element["b"] * coeff_b
 
 
+def _cpu_budget_env(element):
+    """Return the CPU budget of the current process and of a nested factory."""
+    factory = init_parallel_factory("multiprocessing")
+    nested_processes = factory.nb_processes
+    factory.shutdown()
+    return (
+        element,
+        os.environ["PARALLEL_CPU_BUDGET"],
+        os.environ["OMP_NUM_THREADS"],
+        nested_processes,
+    )
+
+
+def _timed_sleep(element):
+    """Sleep and return the start and end times."""
+    start = time.time()
+    time.sleep(0.1)
+    return element, start, time.time()
+
+
+def _array_function(element):
+    """Return a small and a large array."""
+    return {
+        "element": element,
+        "small": np.arange(10) * element,
+        "large": np.linspace(0, element, 1000),
+    }
+
+
 @pytest.fixture
 def int_data():
     """Fixture for simple integer data range."""
@@ -112,12 +153,461 @@ class TestFactories:
                 meta = pd.DataFrame({name: pd.Series(dtype="object")})
                 res = list(mapper(evaluation_function, mapped_data, *args, meta=meta, **kwargs))
                 res = pd.concat(res)
-                res = res.iloc[:, 0].tolist()
+                res = sorted(res.iloc[:, 0].tolist())
+                expected_result = sorted(expected_result)
             else:
                 res = sorted(mapper(evaluation_function, mapped_data, *args, **kwargs))
 
             assert res == expected_result
 
+    @pytest.mark.parametrize("max_pending_batches", [None, 1, 2, 3])
+    def test_max_pending_batches(self, max_pending_batches):
+        """Test that the next batches are submitted before the current one is consumed."""
+        events = []
+
+        def _eager_mapper(func, iterable):
+            events.append(("submit", iterable[0]))
+
+            def _results():
+                for i in iterable:
+                    events.append(("result", i))
+                    yield func(i)
+
+            return _results()
+
+        factory = init_parallel_factory(None, max_pending_batches=max_pending_batches)
+        res = list(
+            factory._with_batches(  # pylint: disable=protected-access
+                _eager_mapper, _evaluation_function_range, list(range(6)), batch_size=2
+            )
+        )
+
+        assert res == expected_results(range(6), _evaluation_function_range)
+        nb_pending = max_pending_batches or 1
+        for num, first_element in enumerate([0, 2, 4]):
+            submit_pos = events.index(("submit", first_element))
+            # The batches are submitted before the previous ones are consumed
+            if num >= nb_pending:
+                assert events.index(("result", first_element - 2 * nb_pending + 1)) < submit_pos
+            else:
+                assert all(event[0] == "submit" for event in events[:submit_pos])
+
+    @pytest.mark.parametrize("batch_size", [None, 7])
+    def test_dask_tasks_per_worker(self, dask_cluster, batch_size, monkeypatch):
+        """Test that the dask factory keeps a bounded number of tasks in the scheduler."""
+        factory = init_parallel_factory(
+            "dask", address=dask_cluster, batch_size=batch_size, tasks_per_worker=2
+        )
+        window_size = 2 * factory.nb_processes
+        mapper = factory.get_mapper()
+
+        nb_submitted = []
+        client_map = factory.client.map
+        client_submit = factory.client.submit
+
+        def _map(func, iterable, **kwargs):
+            nb_submitted.append(len(iterable))
+            return client_map(func, iterable, **kwargs)
+
+        def _submit(func, element, **kwargs):
+            nb_submitted.append(1)
+            return client_submit(func, element, **kwargs)
+
+        monkeypatch.setattr(factory.client, "map", _map)
+        monkeypatch.setattr(factory.client, "submit", _submit)
+
+        res = []
+        for i in mapper(_evaluation_function_range, range(50), coeff_a=2.0):
+            res.append(i)
+            # The task of the next result is submitted before the current result is yielded
+            assert sum(nb_submitted) - len(res) <= window_size
+
+        assert sorted(res) == expected_results(range(50), _evaluation_function_range, coeff_a=2.0)
+
+    @pytest.mark.parametrize("tasks_per_worker", [None, 2])
+    @pytest.mark.parametrize("bundle_size", [1, 3, 999])
+    def test_dask_bundle_size(self, dask_cluster, bundle_size, tasks_per_worker, monkeypatch):
+        """Test that the dask factory evaluates several elements in each task."""
+        factory = init_parallel_factory(
+            "dask",
+            address=dask_cluster,
+            bundle_size=bundle_size,
+            tasks_per_worker=tasks_per_worker,
+        )
+        mapper = factory.get_mapper()
+
+        bundles = []
+        client_map = factory.client.map
+        client_submit = factory.client.submit
+
+        def _map(func, iterable, **kwargs):
+            bundles.extend(iterable)
+            return client_map(func, iterable, **kwargs)
+
+        def _submit(func, element, **kwargs):
+            bundles.append(element)
+            return client_submit(func, element, **kwargs)
+
+        monkeypatch.setattr(factory.client, "map", _map)
+        monkeypatch.setattr(factory.client, "submit", _submit)
+
+        res = sorted(mapper(_evaluation_function_range, range(10), coeff_b=3.0))
+
+        assert res == expected_results(range(10), _evaluation_function_range, coeff_b=3.0)
+        assert len(bundles) == -(-10 // bundle_size)
+        assert sorted(i for bundle in bundles for i in bundle) == list(range(10))
+
+    def test_dask_dataframe_by_partition(self, dask_cluster, dict_data):
+        """Test that the dask dataframe factory can apply a function on each partition."""
+        factory = init_parallel_factory("dask_dataframe", address=dask_cluster)
+        mapper = factory.get_mapper(chunk_size=3)
+        meta = pd.DataFrame({"result": pd.Series(dtype=float)})
+
+        def _partition_func(partition):
+            results = [_evaluation_function_dict(row) for row in partition.to_dict("records")]
+            return pd.DataFrame(
+                {"result": results},
+                index=partition.index,
+                dtype=float,
+            )
+
+        # The partitions are yielded in completion order
+        res = pd.concat(
+            mapper(_partition_func, dict_data, meta=meta, by_partition=True)
+        ).sort_index()
+
+        assert res["result"].dtype == float
+        assert res["result"].tolist() == expected_results(dict_data, _evaluation_function_dict)
+
+    @pytest.mark.parametrize("factory_type", ["ipyparallel"])
+    def test_ipyparallel_chunks(self, parallel_factory):
+        """Test that the ipyparallel factory sends the elements in chunks."""
+        mapper = parallel_factory.get_mapper(chunk_size=3)
+        res = sorted(mapper(_evaluation_function_range, range(10), coeff_b=2.0))
+
+        assert res == expected_results(range(10), _evaluation_function_range, coeff_b=2.0)
+        nb_elements = [timing["nb_elements"] for timing in parallel_factory.task_timings]
+        assert sum(nb_elements) == 10
+        assert max(nb_elements) <= 3
+        assert all(timing["duration"] >= 0 for timing in parallel_factory.task_timings)
+
+        # Only the timings of the last chunks are kept
+        parallel_factory.task_timings = deque(maxlen=2)
+        sorted(mapper(_evaluation_function_range, range(10)))
+        assert len(parallel_factory.task_timings) == 2
+
+    @pytest.mark.parametrize("cpu_budget, processes, expected", [(8, 2, 4), (3, 2, 1), (2, 4, 1)])
+    def test_cpu_budget(self, cpu_budget, processes, expected, monkeypatch):
+        """Test that the CPU budget is shared between the processes of nested pools."""
+        monkeypatch.setenv("PARALLEL_CPU_BUDGET", str(cpu_budget))
+        monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+        factory = init_parallel_factory("multiprocessing", processes=processes)
+        mapper = factory.get_mapper()
+
+        res = sorted(mapper(_cpu_budget_env, range(4)))
+
+        assert res == [(i, str(expected), str(expected), expected) for i in range(4)]
+        factory.shutdown()
+
+    def test_cpu_budget_keep_lower_limits(self, monkeypatch):
+        """Test that the thread limits lower than the CPU budget are kept."""
+        # Register the variables modified by the test so they are restored by monkeypatch
+        env_vars = parallel._THREADS_ENV_VARS  # pylint: disable=protected-access
+        for env_var in ["PARALLEL_CPU_BUDGET"] + env_vars:
+            monkeypatch.setenv(env_var, "")
+            monkeypatch.delenv(env_var)
+        monkeypatch.setenv("OMP_NUM_THREADS", "1")
+        monkeypatch.setenv("MKL_NUM_THREADS", "8")
+        monkeypatch.setenv("OPENBLAS_NUM_THREADS", "unknown")
+
+        parallel._set_cpu_budget(4)  # pylint: disable=protected-access
+
+        assert os.environ["PARALLEL_CPU_BUDGET"] == "4"
+        assert os.environ["OMP_NUM_THREADS"] == "1"
+        assert os.environ["MKL_NUM_THREADS"] == "4"
+        assert os.environ["OPENBLAS_NUM_THREADS"] == "4"
+        assert os.environ["NUMEXPR_NUM_THREADS"] == "4"
+
+    @pytest.mark.parametrize(
+        "affinity, processes, expected",
+        [
+            ("pack", 4, [[0, 1], [2, 3], [4, 5], [6, 7]]),
+            ("spread", 4, [[0, 1], [4, 5], [2, 3], [6, 7]]),
+            ("spread", 3, [[0, 1], [4, 5, 6, 7], [2, 3]]),
+            ("pack", 10, [[0], [1], [2], [3], [4], [5], [6], [7], [0], [1]]),
+        ],
+    )
+    def test_compute_core_sets(self, affinity, processes, expected):
+        """Test the placement of the processes on the NUMA nodes."""
+        nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+        assert _compute_core_sets(processes, affinity, nodes) == expected
+
+        with pytest.raises(ValueError, match=r"The affinity must be one of"):
+            _compute_core_sets(processes, "UNKNOWN", nodes)
+
+    @pytest.mark.parametrize("affinity", ["pack", "spread"])
+    def test_affinity(self, affinity):
+        """Test that the processes of the multiprocessing factory are pinned to their CPUs."""
+        available = sorted(os.sched_getaffinity(0))
+        factory = init_parallel_factory("multiprocessing", processes=2, affinity=affinity)
+        mapper = factory.get_mapper()
+
+        res = sorted(mapper(_evaluation_function_range, range(10)))
+        assert res == expected_results(range(10), _evaluation_function_range)
+
+        affinities = list(factory.worker_affinities().values())
+        assert sorted(affinities) == sorted(factory.pool.core_sets)
+        if len(available) >= 2:
+            assert not set(affinities[0]) & set(affinities[1])
+        factory.shutdown()
+
+    def test_init_pool_worker(self, monkeypatch):
+        """Test that the pool workers take the core sets of the exited workers."""
+        affinities = []
+        budgets = []
+        initialized = []
+        monkeypatch.setattr(os, "sched_setaffinity", lambda pid, cpus: affinities.append(cpus))
+        monkeypatch.setattr(parallel, "_set_cpu_budget", budgets.append)
+
+        # The first slot is used by a living process and the second one by an exited process
+        with subprocess.Popen([sys.executable, "-c", "pass"]) as exited:
+            exited.wait()
+        slot_owners = multiprocessing.Array("i", [os.getppid(), exited.pid, 0])
+        core_sets = [[0, 1], [2], [3]]
+
+        for _ in range(2):
+            parallel._init_pool_worker(  # pylint: disable=protected-access
+                4, initialized.append, ("init",), core_sets, slot_owners
+            )
+        assert affinities == [[2], [3]]
+        assert budgets == [1, 1]
+        assert initialized == ["init", "init"]
+        assert list(slot_owners) == [os.getppid(), os.getpid(), os.getpid()]
+
+        # Without core sets, only the CPU budget is set
+        parallel._init_pool_worker(4)  # pylint: disable=protected-access
+        assert budgets == [1, 1, 4]
+        assert len(affinities) == 2
+
+    def test_nested_pool_positional_args(self):
+        """Test that the positional arguments of the nested pool are the ones of the pools."""
+        pool = parallel.NestedPool(1, None, (), 2)
+        assert pool.core_sets is None
+        assert pool._maxtasksperchild == 2  # pylint: disable=protected-access
+        pool.close()
+        pool.join()
+
+    def test_memory_budget(self):
+        """Test that the running tasks of the multiprocessing factory fit in the memory budget."""
+        estimates = [6, 6, 1, 1, 1, 1, 12, 2]
+        factory = init_parallel_factory("multiprocessing", processes=4, memory_budget=10)
+        mapper = factory.get_mapper()
+
+        res = list(mapper(_timed_sleep, range(len(estimates)), memory_estimates=estimates))
+        assert sorted(i[0] for i in res) == list(range(len(estimates)))
+
+        # The large task runs alone and the others never exceed the budget, which is checked
+        # when each task starts
+        for element, start, _end in res:
+            running = [i for i, i_start, i_end in res if i_start <= start < i_end]
+            if estimates[element] > 10:
+                assert running == [element]
+            else:
+                assert sum(estimates[i] for i in running) <= 10
+
+        # The invalid estimates can not bypass the budget
+        for invalid in [float("nan"), -1]:
+            with pytest.raises(ValueError, match=r"The memory estimates must be non-negative"):
+                list(mapper(_timed_sleep, range(2), memory_estimates=[1, invalid]))
+
+        with pytest.raises(ValueError, match=r"The memory budget of the factory must be set"):
+            init_parallel_factory("multiprocessing").get_mapper()(
+                _timed_sleep, range(2), memory_estimates=[1, 1]
+            )
+        factory.shutdown()
+
+    @pytest.mark.parametrize(
+        "factory_kwargs",
+        [{}, {"batch_size": 3}, {"tasks_per_worker": 1}, {"batch_size": 3, "tasks_per_worker": 1}],
+    )
+    def test_dask_memory_resources(self, factory_kwargs):
+        """Test that the memory estimates are given to dask as resources of the tasks."""
+        estimates = [6, 6, 1, 1, 1, 1, 10, 2]
+        with dask.distributed.LocalCluster(
+            n_workers=1, threads_per_worker=4, resources={"MEMORY": 10}, dashboard_address=None
+        ) as cluster:
+            factory = init_parallel_factory("dask", address=cluster, **factory_kwargs)
+            mapper = factory.get_mapper()
+            res = list(mapper(_timed_sleep, range(len(estimates)), memory_estimates=estimates))
+            assert sorted(i[0] for i in res) == list(range(len(estimates)))
+
+            # The running tasks never exceed the memory resource of the worker
+            for _element, start, _end in res:
+                running = [i for i, i_start, i_end in res if i_start <= start < i_end]
+                assert sum(estimates[i] for i in running) <= 10
+
+            factory.bundle_size = 2
+            with pytest.raises(ValueError, match="The memory estimates can not be used with"):
+                factory.get_mapper()(_timed_sleep, range(2), memory_estimates=[1, 1])
+            factory.shutdown()
+
+    @pytest.mark.parametrize("memory_estimates", [None, [1] * 6])
+    def test_out_of_band(self, memory_estimates):
+        """Test that the large arrays are sent through the shared memory."""
+        factory = init_parallel_factory(
+            "multiprocessing", processes=2, out_of_band_threshold=1000, memory_budget=10
+        )
+        mapper = factory.get_mapper()
+        shm_pattern = os.path.join(
+            parallel._SHARED_MEMORY_DIR, "bluepyparallel_*"  # pylint: disable=protected-access
+        )
+        shm_files = set(glob.glob(shm_pattern))
+
+        res = sorted(
+            mapper(_array_function, range(6), memory_estimates=memory_estimates),
+            key=lambda i: i["element"],
+        )
+        for element, result in enumerate(res):
+            expected = _array_function(element)
+            assert result["element"] == element
+            assert_array_equal(result["small"], expected["small"])
+            assert_array_equal(result["large"], expected["large"])
+
+        # The large arrays are mapped from the shared memory and can be modified
+        assert not res[0]["large"].flags.owndata
+        res[0]["large"][0] = -1
+
+        # The shared memory files are removed
+        assert set(glob.glob(shm_pattern)) <= shm_files
+
+        # The files of the results that are not consumed are removed
+        results = mapper(_array_function, range(6), memory_estimates=memory_estimates)
+        assert next(results)["large"].size > 0
+        results.close()
+        factory.pool.close()
+        factory.pool.join()
+        factory.shutdown()
+        assert set(glob.glob(shm_pattern)) <= shm_files
+
+    def test_out_of_band_in_process(self, tmpdir, monkeypatch):
+        """Test the out-of-band wrapper and loader in the current process."""
+        # pylint: disable=protected-access
+        monkeypatch.setattr(parallel, "_SHARED_MEMORY_DIR", str(tmpdir))
+        prefix = "bluepyparallel_test_"
+        expected = _array_function(2)
+
+        # The small results are sent in the pickle stream
+        result = parallel._out_of_band_wrapper(2, _array_function, 10**9, prefix)
+        assert result.path is None
+        assert_array_equal(result.load()["large"], expected["large"])
+
+        # The large buffers are written into a file that is removed when the result is loaded
+        result = parallel._out_of_band_wrapper(2, _array_function, 1000, prefix)
+        assert os.path.basename(result.path).startswith(prefix)
+        assert result.sizes == [expected["large"].nbytes]
+        loaded = result.load()
+        assert_array_equal(loaded["small"], expected["small"])
+        assert_array_equal(loaded["large"], expected["large"])
+        assert not os.listdir(tmpdir)
+
+        # The file is removed when it can not be loaded
+        result = parallel._out_of_band_wrapper(2, _array_function, 1000, prefix)
+        with open(result.path, "wb"):
+            pass
+        with pytest.raises(ValueError):
+            result.load()
+        assert not os.listdir(tmpdir)
+
+        # The file is removed when it can not be written
+        def _failing_fdopen(fd, *args, **kwargs):
+            os.close(fd)
+            raise OSError("No space left on device")
+
+        with monkeypatch.context() as m:
+            m.setattr(os, "fdopen", _failing_fdopen)
+            with pytest.raises(OSError, match="No space left on device"):
+                parallel._out_of_band_wrapper(2, _array_function, 1000, prefix)
+        assert not os.listdir(tmpdir)
+
+        # The files of the results that are not loaded are removed
+        factory = SimpleNamespace(_interrupted_prefixes=[])
+        results = parallel.MultiprocessingFactory._load_out_of_band(
+            factory,
+            [parallel._out_of_band_wrapper(i, _array_function, 1000, prefix) for i in range(3)],
+            prefix,
+        )
+        assert next(results)["element"] == 0
+        results.close()
+        assert not os.listdir(tmpdir)
+        assert factory._interrupted_prefixes == [prefix]
+
+        results = parallel.MultiprocessingFactory._load_out_of_band(
+            factory, [parallel._out_of_band_wrapper(3, _array_function, 1000, prefix)], "other_"
+        )
+        assert [result["element"] for result in results] == [3]
+        assert factory._interrupted_prefixes == [prefix]
+
+    @pytest.mark.parametrize("bundle_size", [None, 3])
+    def test_dask_pool(self, bundle_size):
+        """Test that the dask pool factory evaluates the bundles in local process pools."""
+        # The workers of the default cluster are daemon processes that can not create pools
+        with dask.distributed.LocalCluster(
+            n_workers=2, processes=False, dashboard_address=None
+        ) as cluster:
+            factory = init_parallel_factory(
+                "dask_pool", address=cluster, processes_per_worker=2, bundle_size=bundle_size
+            )
+            assert factory.bundle_size == (bundle_size or 8)
+
+            mapper = factory.get_mapper()
+            res = sorted(mapper(_evaluation_function_range, range(20), coeff_a=2.0))
+
+            assert res == expected_results(range(20), _evaluation_function_range, coeff_a=2.0)
+            factory.shutdown()
+
+        # The workers are threads of the current process, which thus contains their pool
+        assert list(parallel._LOCAL_POOLS) == [2]  # pylint: disable=protected-access
+        parallel._close_local_pools()  # pylint: disable=protected-access
+        assert not parallel._LOCAL_POOLS  # pylint: disable=protected-access
+
+    def test_dask_pool_worker_budget(self, monkeypatch):
+        """Test that the size of the local process pools is the CPU budget of the workers."""
+        monkeypatch.setenv("PARALLEL_CPU_BUDGET", "3")
+        with dask.distributed.LocalCluster(
+            n_workers=1, processes=False, dashboard_address=None
+        ) as cluster:
+            factory = init_parallel_factory("dask_pool", address=cluster)
+            assert factory.processes_per_worker is None
+            assert factory.bundle_size == 12
+
+            mapper = factory.get_mapper()
+            res = sorted(mapper(_evaluation_function_range, range(20)))
+
+            assert res == expected_results(range(20), _evaluation_function_range)
+            factory.shutdown()
+
+        assert list(parallel._LOCAL_POOLS) == [3]  # pylint: disable=protected-access
+        parallel._close_local_pools()  # pylint: disable=protected-access
+
+    @pytest.mark.skipif(shutil.which("mpirun") is None, reason="Requires mpirun")
+    def test_mpi_workers(self):
+        """Test the MPI factory with several ranks."""
+        # Must test using a subprocess because the workers exit when the factory is created
+        code = """if True:  # This is just to avoid indentation issue
+        from bluepyparallel import init_parallel_factory
+
+        factory = init_parallel_factory("mpi", chunk_size=3)
+        assert factory.nb_processes == 3
+
+        mapper = factory.get_mapper()
+        for i in range(2):
+            res = sorted(mapper(abs, range(-20, 0)))
+            assert res == list(range(1, 21)), res
+
+        factory.shutdown()
+        """
+        subprocess.check_call(["mpirun", "-n", "4", sys.executable, "-c", code])
+
     def test_bad_factory_name(self):
         """Test a factory with a wrong name."""
         with pytest.raises(KeyError):
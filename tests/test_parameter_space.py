@@ -0,0 +1,107 @@
+"""Test the ``bluepyparallel.parameter_space`` module."""
+
+# Copyright 2021-2024 Blue Brain Project / EPFL
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-function-docstring
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas._testing import assert_frame_equal
+
+from bluepyparallel.parameter_space import LatinHypercubeSampler
+from bluepyparallel.parameter_space import ParameterGrid
+from bluepyparallel.parameter_space import SobolSampler
+
+try:
+    import scipy  # noqa ; pylint: disable=unused-import
+
+    scipy_available = True
+except ImportError:  # pragma: no cover
+    scipy_available = False
+
+BOUNDS = {"a": (0, 1), "b": (-10, 10), "c": (5, 6)}
+
+
+class TestParameterGrid:
+    """Test the ``ParameterGrid`` class."""
+
+    def test_rows(self):
+        """Test that the rows are the ones of the Cartesian product."""
+        axes = {"a": [1, 2, 3], "b": ["x", "y"], "c": [0.5, 1.5]}
+        grid = ParameterGrid(axes)
+        assert len(grid) == 12
+        assert grid.columns == ["a", "b", "c"]
+
+        expected = pd.DataFrame(list(itertools.product(*axes.values())), columns=grid.columns)
+        assert_frame_equal(grid.to_dataframe(), expected, check_index_type=False)
+        assert_frame_equal(grid.rows([11, 3, 4]), expected.loc[[11, 3, 4]], check_index_type=False)
+
+    def test_object_axes(self):
+        """Test that the values of the axes are not coerced."""
+        grid = ParameterGrid({"a": [1, "x"], "b": [(1, 2), (3, 4)]})
+        res = grid.to_dataframe()
+        assert res["a"].tolist() == [1, 1, "x", "x"]
+        assert res["b"].tolist() == [(1, 2), (3, 4), (1, 2), (3, 4)]
+        assert grid.rows([0])["a"].dtype == object
+
+    def test_errors(self):
+        """Test the errors of the grid."""
+        with pytest.raises(ValueError, match="At least one axis must be given"):
+            ParameterGrid({})
+
+        with pytest.raises(IndexError, match="The row IDs must be between 0 and 5"):
+            ParameterGrid({"a": [1, 2], "b": [1, 2, 3]}).rows([6])
+
+
+class TestSamplers:
+    """Test the samplers."""
+
+    def test_latin_hypercube(self):
+        """Test that the samples are in the bounds and stratified."""
+        sampler = LatinHypercubeSampler(BOUNDS, 50, seed=0)
+        assert len(sampler) == 50
+        assert sampler.deterministic
+        sample = sampler.to_dataframe()
+
+        for name, (lower, upper) in BOUNDS.items():
+            strata = np.floor((sample[name] - lower) / (upper - lower) * 50)
+            assert sorted(strata) == list(range(50))
+
+        # The rows are the same when they are generated again
+        assert_frame_equal(
+            LatinHypercubeSampler(BOUNDS, 50, seed=0).rows([10, 5]), sample.loc[[10, 5]]
+        )
+        assert not LatinHypercubeSampler(BOUNDS, 50).deterministic
+
+        with pytest.raises(ValueError, match="At least one parameter must be given"):
+            LatinHypercubeSampler({}, 10)
+
+    @pytest.mark.skipif(not scipy_available, reason="scipy is not installed")
+    def test_sobol(self):
+        """Test that the rows of the Sobol sequence can be generated by chunks."""
+        sampler = SobolSampler(BOUNDS, 16, seed=0)
+        assert sampler.deterministic
+        sample = sampler.to_dataframe()
+        for name, (lower, upper) in BOUNDS.items():
+            assert ((sample[name] >= lower) & (sample[name] <= upper)).all()
+
+        assert_frame_equal(sampler.rows(np.arange(5, 12)), sample.loc[5:11])
+        assert_frame_equal(sampler.rows([]), sample.iloc[:0], check_index_type=False)
+        assert SobolSampler(BOUNDS, 16, scramble=False).deterministic
+
+        with pytest.warns(UserWarning, match="The balance properties of Sobol' points require"):
+            SobolSampler(BOUNDS, 10, seed=0)
@@ -0,0 +1,174 @@
+"""Test the ``bluepyparallel.pipeline`` module."""
+
+# Copyright 2021-2024 Blue Brain Project / EPFL
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+import pandas as pd
+import pytest
+from pandas._testing import assert_frame_equal
+
+from bluepyparallel import Stage
+from bluepyparallel import evaluate_pipeline
+from bluepyparallel import init_parallel_factory
+from bluepyparallel.checkpoint import CheckpointLog
+from bluepyparallel.parallel import DaskDataFrameFactory
+
+
+def _generate(row, offset=0.0):
+    """Mock generation stage."""
+    return {"generated": row["value"] + offset}
+
+
+def _simulate(row):
+    """Mock simulation stage."""
+    if row["generated"] == 2:
+        raise ValueError("The generated value should not be 2")
+    return {"simulated": 10 * row["generated"]}
+
+
+def _extract(row):
+    """Mock feature extraction stage."""
+    return {"feature": row["simulated"] + row["value"]}
+
+
+def _unexpected(row):
+    """Mock stage that should not be evaluated."""
+    raise RuntimeError("This stage should not be evaluated")
+
+
+def _stages(tmpdir=None):
+    """Build the stages of the pipeline."""
+    checkpoint_paths = {}
+    if tmpdir is not None:
+        checkpoint_paths = {
+            name: str(tmpdir / f"{name}.log") for name in ["generate", "simulate", "extract"]
+        }
+    return [
+        Stage(
+            "generate",
+            _generate,
+            [["generated", 0.0]],
+            func_kwargs={"offset": 1.0},
+            checkpoint_path=checkpoint_paths.get("generate"),
+        ),
+        Stage(
+            "simulate",
+            _simulate,
+            [["simulated", -1.0]],
+            checkpoint_path=checkpoint_paths.get("simulate"),
+        ),
+        Stage(
+            "extract",
+            _extract,
+            [["feature", 0.0]],
+            checkpoint_path=checkpoint_paths.get("extract"),
+        ),
+    ]
+
+
+@pytest.fixture
+def input_df():
+    """Fixture with the input DF."""
+    return pd.DataFrame({"value": [0.0, 1.0, 2.0, 3.0]})
+
+
+@pytest.fixture
+def expected_df(input_df):
+    """Fixture with expected DF."""
+    expected_df = input_df.copy()
+    expected_df["generate_exception"] = None
+    expected_df["generated"] = [1.0, 2.0, 3.0, 4.0]
+    expected_df["simulate_exception"] = None
+    # The failed rows keep the empty values of the stage
+    expected_df["simulated"] = [10.0, -1.0, 30.0, 40.0]
+    expected_df["extract_exception"] = None
+    expected_df["feature"] = [10.0, 0.0, 32.0, 43.0]
+    return expected_df
+
+
+def _check_result(result_df, expected_df):
+    """Check the results, the exception of the second row is only checked partially."""
+    assert "The generated value should not be 2" in result_df.loc[1, "simulate_exception"]
+    result_df.loc[1, "simulate_exception"] = None
+    assert_frame_equal(result_df, expected_df, check_dtype=False)
+
+
+class TestEvaluatePipeline:
+    """Test the ``bluepyparallel.pipeline.evaluate_pipeline`` function."""
+
+    def test_evaluate_pipeline(self, input_df, expected_df, parallel_factory):
+        """Test the pipeline on a trivial example."""
+        if isinstance(parallel_factory, DaskDataFrameFactory):
+            with pytest.raises(ValueError, match="can not be used with 'DaskDataFrameFactory'"):
+                evaluate_pipeline(input_df, _stages(), parallel_factory=parallel_factory)
+            return
+
+        result_df = evaluate_pipeline(input_df, _stages(), parallel_factory=parallel_factory)
+        _check_result(result_df, expected_df)
+
+    @pytest.mark.parametrize("shuffle_rows", [True, False])
+    def test_resume(self, tmpdir, input_df, expected_df, shuffle_rows):
+        """Test that the pipeline is resumed from the checkpoint logs of the stages."""
+        # An empty checkpoint log is ignored
+        checkpoint = CheckpointLog(tmpdir / "generate.log")
+        checkpoint.create()
+        checkpoint.close()
+        result_df = evaluate_pipeline(
+            input_df, _stages(tmpdir), resume=True, shuffle_rows=shuffle_rows, progress_bar=False
+        )
+        _check_result(result_df, expected_df)
+
+        # Remove the last stage of the last row and the last 2 stages of the first row
+        for name, removed in [("simulate", [0]), ("extract", [0, 3])]:
+            checkpoint = CheckpointLog(tmpdir / f"{name}.log")
+            records = checkpoint.load()
+            checkpoint.create()
+            for task_id, values in records.drop(index=removed).to_dict("index").items():
+                checkpoint.append(task_id, values)
+            checkpoint.close()
+
+        # The stages that are in the checkpoint logs are not computed again, even when the rows
+        # starting from different stages are split into batches
+        stages = _stages(tmpdir)
+        stages[0].evaluation_function = _unexpected
+        result_df = evaluate_pipeline(
+            input_df,
+            stages,
+            resume=True,
+            parallel_factory=init_parallel_factory(None, batch_size=2),
+            progress_bar=False,
+        )
+        _check_result(result_df, expected_df)
+
+        # The new results are appended to the checkpoint logs
+        assert sorted(CheckpointLog(tmpdir / "extract.log").load().index) == [0, 2, 3]
+
+        # Nothing is computed again
+        for stage in stages:
+            stage.evaluation_function = _unexpected
+        result_df = evaluate_pipeline(input_df, stages, resume=True, progress_bar=False)
+        _check_result(result_df, expected_df)
+
+    def test_errors(self, input_df):
+        """Test the errors of the pipelines."""
+        with pytest.raises(ValueError, match="At least one stage must be given"):
+            evaluate_pipeline(input_df, [])
+
+        with pytest.raises(ValueError, match="The names of the stages must be unique"):
+            evaluate_pipeline(input_df, [Stage("a", _generate), Stage("a", _generate)])
+
+        with pytest.raises(ValueError, match="The new columns of the stages must be unique"):
+            evaluate_pipeline(input_df, [Stage("a", _generate, [["value", 0.0]])])